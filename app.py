@@ -1,76 +1,70 @@
-import os
 import streamlit as st
 from http import HTTPStatus
-from dashscope import Generation
 import dashscope
-from embedding_web import vectorize_and_store, convert_text, split_text
-import time
-from search_web import search_relevant_news
-from pdf_topics_web import extract_pdf_topics, draw_knowledge_graph, load_document, visualize_text_processing, process_document
-import speech_recognition as sr
-import pyttsx3
-import threading
+from embedding_web import convert_text, split_text
+from qa_pipeline import retrieve_context, stream_answer
+from speech_worker import SpeechWorker, start_speech_to_text
+from model_router import AUTO_MODEL, DEFAULT_LATENCY_BUDGET, generate_stream
+from pdf_topics_web import extract_pdf_topics, draw_knowledge_graph, load_document, visualize_text_processing, process_document, \
+    STREAMING_THRESHOLD_BYTES
 from prompts import GovernmentAgentPrompts
-
-#语音全局变量
-current_engine = None
+from loaders import list_documents, supported_extensions
+from ingest_jobs import IngestJobManager, QUEUED, RUNNING, SUCCEEDED, PARTIAL, FAILED, CANCELLED, INTERRUPTED, \
+    FINISHED_STATUSES
+
+JOB_STATUS_LABELS = {
+    QUEUED: "排队中",
+    RUNNING: "解析中",
+    SUCCEEDED: "已完成",
+    PARTIAL: "部分失败",
+    FAILED: "失败",
+    CANCELLED: "已取消",
+    INTERRUPTED: "已中断",
+}
 # Define multi-round conversation function
-def multi_round(messages, option, model, endpoint_api_key, endpoint_api_secret, collection_name):
+def multi_round(messages, option, model, endpoint_api_key, endpoint_api_secret, collection_name, query=None,
+                task_type=None, latency_budget=DEFAULT_LATENCY_BUDGET):
+    """
+    流式生成回答。
+    :return: 回答文本增量的生成器，出错时用 st.error 显示错误并停止产出
+    """
+    # model 为 "Auto" 时按问题难度和各模型实测延迟自动选择模型
+    routing = {"question": query or messages[-1]["content"], "task_type": task_type, "latency_budget": latency_budget}
     if option == "Default":
-        response = Generation.call(
-            model=model,
-            messages=messages,
-            result_format='message'
-        )
-        if response.status_code == HTTPStatus.OK:
-            new_message = {
-                'role': response.output.choices[0]['message']['role'],
-                'content': response.output.choices[0]['message']['content']
-            }
-            messages.append(new_message)
-            return messages, new_message
-        else:
-            st.error(f"Request id: {response.request_id}, Status code: {response.status_code}, "
-                     f"error code: {response.code}, error message: {response.message}")
-            return messages[:-1], None
+        for response in generate_stream(model, messages=messages, result_format='message', **routing):
+            if response.status_code != HTTPStatus.OK:
+                st.error(f"Request id: {response.request_id}, Status code: {response.status_code}, "
+                         f"error code: {response.code}, error message: {response.message}")
+                return
+            delta = response.output.choices[0]['message']['content']
+            if delta:
+                yield delta
     elif option == "RAG":
         question = messages[-1]["content"]
-        best_match_news = search_relevant_news(question, endpoint_api_key, endpoint_api_secret, collection_name)
-        response_message = answer_question(question, best_match_news, model)
-        new_message = {
-            'role': 'assistant',
-            'content': response_message
-        }
-        messages.append(new_message)
-        return messages, new_message
-
-
-def answer_question(question, context, model):
-    prompt = f'''请基于```内的内容回答问题。"
-    ```
-    {context}
-    ```
-    我的问题是：{question}。
-    '''
-
-    rsp = Generation.call(model=model,
-                          prompt=prompt)
-    if rsp.status_code == HTTPStatus.OK:
-        return rsp.output.text.strip()
-    else:
-        st.error(f"Request id: {rsp.request_id}, Status code: {rsp.status_code}, "
-                 f"error code: {rsp.code}, error message: {rsp.message}")
-        return "Error"
+        best_match_news = retrieve_context(question, query, endpoint_api_key, endpoint_api_secret, collection_name)
+        yield from stream_answer(question, best_match_news, model, routing, on_error=st.error)
 
 
 # Real-time display function
-def display_realtime_message(message_content, placeholder, role):
+def display_realtime_message(deltas, placeholder, role, speech_stream=None):
+    """
+    边生成边显示回答，并把每段新增文本送入朗读流。
+    :param deltas: 回答文本增量的可迭代对象
+    :return: 完整回答文本
+    """
     full_text = ""
-    for char in message_content:
-        full_text += char
-        with placeholder:
-            st.chat_message(role).write(full_text)
-        time.sleep(0.05)  # Control the display speed
+    try:
+        for delta in deltas:
+            full_text += delta
+            with placeholder:
+                st.chat_message(role).write(full_text)
+            # 每凑齐一句就开始朗读，不必等整段生成完
+            if speech_stream is not None:
+                speech_stream.feed(delta)
+    finally:
+        if speech_stream is not None:
+            speech_stream.close()
+    return full_text
 
 
 # Sidebar design
@@ -101,7 +95,7 @@ def sidebar_configuration():
         "[![Open in GitHub Codespaces](https://github.com/codespaces/badge.svg)](https://codespaces.new/streamlit/llm-examples?quickstart=1)")
     pdf_folder_path = st.sidebar.text_input("资料来源", key="pdf_folder_path")
 
-    pdf_files = list_pdf_files(pdf_folder_path)
+    pdf_files = list_documents(pdf_folder_path)
     if pdf_files:
         st.sidebar.subheader("资料 目录")
         for pdf_file in pdf_files:
@@ -138,13 +132,84 @@ def sidebar_configuration():
     return dashscope_api_key, dashvector_api_key, dashvector_endpoint, pdf_folder_path, task_type
 
 
-def list_pdf_files(pdf_folder_path):
-    pdf_files = []
-    if os.path.isdir(pdf_folder_path):
-        for file_name in os.listdir(pdf_folder_path):
-            if file_name.lower().endswith(".pdf"):
-                pdf_files.append(file_name)
-    return pdf_files
+@st.cache_resource
+def get_ingest_manager():
+    # 进程级单例：工作线程和任务表在脚本重跑、页面刷新之间保持不变
+    return IngestJobManager()
+
+
+def use_ingested_collection(job):
+    st.session_state['collection_name'] = job["collection"]
+    st.session_state["topics"] = job["topics"] or {}
+    st.session_state.messages = [
+        {"role": "assistant", "content": "您好！文件已解析完毕，可询问关于文件里的知识！"}]
+
+
+# 上传文件加入当前资料库的任务结束后合并主题，不切换资料库也不清空对话
+def apply_finished_upload_job():
+    job_id = st.session_state.get('upload_job_id')
+    if job_id is None:
+        return
+    job = get_ingest_manager().get(job_id)
+    if job is None or job["status"] not in FINISHED_STATUSES:
+        return
+    del st.session_state['upload_job_id']
+    if job["status"] in (SUCCEEDED, PARTIAL):
+        st.session_state.setdefault("topics", {}).update(job["topics"] or {})
+    if job["status"] == SUCCEEDED:
+        st.success("文件已加入资料库，可询问关于文件里的知识！")
+        st.caption(job["message"])
+    elif job["status"] == PARTIAL:
+        st.warning(f"部分文本块嵌入失败，可在侧边栏重试：{job['message']}")
+    else:
+        st.error(job["message"] or f"解析任务{JOB_STATUS_LABELS[job['status']]}")
+
+
+# 当前会话提交的解析任务结束后切换到新资料库
+def apply_finished_ingest_job():
+    job_id = st.session_state.get('ingest_job_id')
+    if job_id is None:
+        return
+    job = get_ingest_manager().get(job_id)
+    if job is None or job["status"] not in FINISHED_STATUSES:
+        return
+    del st.session_state['ingest_job_id']
+    if job["status"] == SUCCEEDED:
+        use_ingested_collection(job)
+        st.success("文件已解析完毕，可询问关于文件里的知识！")
+        st.caption(job["message"])
+    elif job["status"] == PARTIAL:
+        # 其余文本块已可检索，嵌入失败的文本块可在侧边栏重试
+        use_ingested_collection(job)
+        st.warning(f"部分文本块嵌入失败，可在侧边栏重试：{job['message']}")
+    else:
+        st.error(job["message"] or f"解析任务{JOB_STATUS_LABELS[job['status']]}")
+
+
+# 侧边栏显示解析任务的状态、进度，并提供取消和重试
+def display_ingest_jobs(dashscope_api_key, dashvector_api_key, dashvector_endpoint):
+    manager = get_ingest_manager()
+    jobs = manager.list_jobs()
+    if not jobs:
+        return
+    st.sidebar.subheader("解析任务")
+    st.sidebar.button("刷新任务状态", key="refresh_ingest_jobs")
+    for job in jobs:
+        st.sidebar.markdown(f"**{job['collection']}** · {JOB_STATUS_LABELS[job['status']]}")
+        progress = job["files_done"] / job["files_total"] if job["files_total"] else 0.0
+        st.sidebar.progress(progress, text=f"{job['files_done']}/{job['files_total']} 个文件，"
+                                           f"已写入 {job['chunks_done']} 个文本块")
+        if job["status"] in (QUEUED, RUNNING):
+            if st.sidebar.button("取消", key=f"cancel_job_{job['id']}"):
+                manager.cancel(job["id"])
+        elif job["status"] in (PARTIAL, FAILED, CANCELLED, INTERRUPTED):
+            if job["message"]:
+                st.sidebar.caption(job["message"])
+            if st.sidebar.button("重试", key=f"retry_job_{job['id']}"):
+                manager.retry(job["id"], dashscope_api_key, dashvector_api_key, dashvector_endpoint)
+        if job["status"] in (SUCCEEDED, PARTIAL) and st.session_state.get('collection_name') != job["collection"]:
+            if st.sidebar.button("使用该资料库", key=f"use_job_{job['id']}"):
+                use_ingested_collection(job)
 
 
 # Initialize conversation history
@@ -170,34 +235,30 @@ def display_messages():
                 st.chat_message(msg["role"]).write(msg["content"])
 
 
-# 在文件开头添加以下导入语句
-import speech_recognition as sr
-import pyttsx3
-import threading
+@st.cache_resource
+def get_speech_worker():
+    # 进程级单例：朗读引擎只初始化一次，所有回答共用一个朗读线程
+    return SpeechWorker()
 
-# 在 main 函数之前添加以下函数
 
-def speech_to_text():
-    recognizer = sr.Recognizer()
-    with sr.Microphone() as source:
-        st.write("请说话...")
-        audio = recognizer.listen(source)
-    try:
-        text = recognizer.recognize_google(audio, language="zh-CN")
-        return text
-    except sr.UnknownValueError:
-        st.error("无法识别语音")
-        return None
-    except sr.RequestError:
-        st.error("无法连接到语音识别服务")
-        return None
-
-def text_to_speech(text):
-    engine = pyttsx3.init()
-    engine.setProperty('rate', 150)
-    engine.setProperty('voice', 'zh')
-    engine.say(text)
-    engine.runAndWait()
+# 语音输入在后台线程中录音识别，脚本线程不被 recognizer.listen 阻塞
+def speech_input_panel():
+    if st.button("语音输入"):
+        st.session_state["speech_future"] = start_speech_to_text()
+
+    speech_future = st.session_state.get("speech_future")
+    if speech_future is None:
+        return
+    if not speech_future.done():
+        st.info("请说话...")
+        st.button("获取识别结果", key="speech_refresh")
+        return
+    del st.session_state["speech_future"]
+    user_input, error = speech_future.result()
+    if error:
+        st.error(error)
+    elif user_input:
+        st.text_input("语音输入结果", value=user_input, key="speech_input")
 
 # Main application logic
 def main():
@@ -232,6 +293,7 @@ def main():
     - qwen-plus：平衡速度和质量，适合较复杂的问题
     - qwen-max：最高质量输出，适合复杂和专业性问题
     - qwen2-72b-instruct：基于 instruct 的 72B 模型，适合复杂、专业问题
+    - Auto：根据问题难度和各模型的实时延迟自动选择模型，超时自动切换到更快的模型
                 
     注意：在 RAG 模式下，您可以上传您需要检索的文档，例如当年政府文件，您的审批表文件等，并在右边弹窗内要使用英文字母进行命名哦。
 
@@ -248,17 +310,24 @@ def main():
     with col2:
         st.markdown('<div class="small-selectbox">', unsafe_allow_html=True)
         model = st.selectbox("选择模型:", [
-            "qwen-turbo",
+            AUTO_MODEL, "qwen-turbo",
             "qwen-turbo-0624", "qwen-turbo-0206", "qwen-plus", "qwen-plus-0624", "qwen-plus-0206",
             "qwen-max", "qwen-max-0428", "qwen-max-0403", "qwen-max-0107", "qwen-max-1201", "qwen-max-longcontext",
             "qwen2-57b-a14b-instruct", "qwen2-72b-instruct", "qwen2-7b-instruct", "qwen2-1.5b-instruct",
             "qwen2-0.5b-instruct", "qwen1.5-110b-chat", "qwen1.5-72b-chat", "qwen1.5-32b-chat",
-        ], key="model_select", index=0, help="选择你需要的模型")
+        ], key="model_select", index=1, help="选择你需要的模型，Auto——按问题难度和实时延迟自动选择")
+        latency_budget = DEFAULT_LATENCY_BUDGET
+        if model == AUTO_MODEL:
+            latency_budget = st.number_input("延迟预算（秒）", min_value=1.0, max_value=60.0,
+                                             value=DEFAULT_LATENCY_BUDGET, step=1.0, key="latency_budget",
+                                             help="超过该时间仍未开始返回时改用更快的模型")
         st.markdown('</div>', unsafe_allow_html=True)
 
    
     dashscope_api_key, dashvector_api_key, dashvector_endpoint, pdf_folder_path, task_type = sidebar_configuration()
+    display_ingest_jobs(dashscope_api_key, dashvector_api_key, dashvector_endpoint)
     initialize_messages()
+    apply_finished_ingest_job()
 
     chat_placeholder = st.container()
 
@@ -272,19 +341,11 @@ def main():
         st.markdown("### Enter Collection Name")
         collection_name = st.text_input("Collection Name", key="collection_name_input")
         if st.button("Submit Collection Name"):
-            st.session_state['collection_name'] = collection_name
             st.session_state['show_modal'] = False
-            with st.spinner("正在解析资料..."):
-                result, topics = vectorize_and_store_and_extract_topics(dashscope_api_key, dashvector_api_key,
-                                                                        dashvector_endpoint, pdf_folder_path,
-                                                                        collection_name)
-                if "successfully" in result:
-                    st.success("文件已解析完毕，可询问关于文件里的知识！")
-                    st.session_state.messages = [
-                        {"role": "assistant", "content": "您好！文件已解析完毕，可询问关于文件里的知识！"}]
-                    st.session_state["topics"] = topics
-                else:
-                    st.error(result)
+            # 在后台线程中解析，解析期间仍可使用当前资料库对话
+            st.session_state['ingest_job_id'] = get_ingest_manager().submit(
+                dashscope_api_key, dashvector_api_key, dashvector_endpoint, pdf_folder_path, collection_name)
+            st.info("已在后台开始解析资料，解析期间可以继续使用当前资料库对话。")
 
     if "topics" in st.session_state:
         # Create a right sidebar for displaying the knowledge graphs
@@ -296,10 +357,7 @@ def main():
                 draw_knowledge_graph(topics, pdf_file)
 
     # 在 chat_placeholder 之后添加语音输入按钮
-    if st.button("语音输入"):
-        user_input = speech_to_text()
-        if user_input:
-            st.text_input("语音输入结果", value=user_input, key="speech_input")
+    speech_input_panel()
 
     # 修改现有的输入处理逻辑
     prompt = st.chat_input("请输入你的问题...") or st.session_state.get("speech_input", "")
@@ -309,6 +367,8 @@ def main():
             st.stop()
 
         dashscope.api_key = dashscope_api_key
+        # 新问题到来时停止朗读上一条回答
+        get_speech_worker().cancel()
 
         # 使用提示系统生成完整的提示，使用默认的任务类型
         full_prompt = GovernmentAgentPrompts.generate_response(task_type, prompt)
@@ -323,16 +383,16 @@ def main():
         response_placeholder = st.empty()
 
         collection_name = st.session_state.get('collection_name', 'default_collection')
-        _, response_message = multi_round([{"role": "user", "content": full_prompt}], option, model,
-                                          dashvector_api_key, dashvector_endpoint,
-                                          collection_name)
+        deltas = multi_round([{"role": "user", "content": full_prompt}], option, model,
+                             dashvector_api_key, dashvector_endpoint,
+                             collection_name, query=prompt, task_type=task_type,
+                             latency_budget=latency_budget)
 
-        if response_message:
-            if response_message["role"] == "assistant":
-                st.session_state.messages.append(response_message)
-                display_realtime_message(response_message["content"], response_placeholder, response_message["role"])
-                # 添加语音输出
-                threading.Thread(target=text_to_speech, args=(response_message["content"],)).start()
+        # 添加语音输出：流式生成的文本边显示边按句送入常驻朗读线程，第一句生成完即开始朗读
+        response_content = display_realtime_message(deltas, response_placeholder, "assistant",
+                                                    speech_stream=get_speech_worker().new_stream())
+        if response_content:
+            st.session_state.messages.append({"role": "assistant", "content": response_content})
 
         st.session_state.chat_records[st.session_state.current_chat_index] = st.session_state.messages
 
@@ -356,11 +416,22 @@ def main():
 
     # 在main()函数中添加以下代码
     if st.checkbox("文档处理和可视化（供政府内部数据分析人员使用，解析并可视化文件的各种文本数据）"):
-        uploaded_file = st.file_uploader("选择一个文件", type=["pdf", "docx", "txt"])
+        uploaded_file = st.file_uploader("选择一个文件", type=supported_extensions())
         if uploaded_file is not None:
-            text, chunks, structure = process_document(uploaded_file)
+            streaming = st.checkbox("逐页流式分析（适用于超大文档，只保留预览和统计结果）",
+                                    value=uploaded_file.size > STREAMING_THRESHOLD_BYTES)
+            text, chunks, structure = process_document(uploaded_file, streaming=streaming)
             if text:
                 st.success("文件处理成功！")
+
+                # 直接将上传的文件嵌入当前资料库，无需先复制到服务器文件夹
+                collection_name = st.session_state.get('collection_name', 'default_collection')
+                if st.button(f"加入当前资料库（{collection_name}）"):
+                    # 与文件夹解析一样交给后台任务，进度和结果显示在侧边栏
+                    st.session_state['upload_job_id'] = get_ingest_manager().submit(
+                        dashscope_api_key, dashvector_api_key, dashvector_endpoint, None, collection_name,
+                        sources=[uploaded_file])
+                    st.info("已在后台开始解析上传的文件，可在侧边栏查看进度。")
                 
                 # 显示处理后的文本块
                 if st.checkbox("显示处理后的文本块"):
@@ -374,13 +445,5 @@ def main():
                     st.json(structure)
 
 
-def vectorize_and_store_and_extract_topics(dashscope_api_key, dashvector_api_key, dashvector_endpoint, pdf_folder_path,
-                                           collection_name):
-    result = vectorize_and_store(dashscope_api_key, dashvector_api_key, dashvector_endpoint, pdf_folder_path,
-                                 collection_name)
-    topics = extract_pdf_topics(pdf_folder_path)
-    return result, topics
-
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,101 @@
+import re
+from chunk_store import get_chunk_store
+from text_structure import (CHINESE_NUMERALS, STRUCTURE_PATH_FIELDS, iter_sections, marker_number, parse_numeral,
+                            update_structure_path)
+
+# 问题中的条文引用，例如“第二十三条”、“第三章第十条”、“第2节第5条”
+ARTICLE_REFERENCE = re.compile(
+    rf'(?:第([{CHINESE_NUMERALS}\d]+)章)?\s*(?:第([{CHINESE_NUMERALS}\d]+)节)?\s*第([{CHINESE_NUMERALS}\d]+)条'
+)
+# 同一条在多个文档中出现时，最多返回的文档数
+MAX_ARTICLE_SOURCES = 3
+
+
+def article_index_rows(record):
+    """
+    由入库记录生成条文索引行。
+    :param record: 包含 "id"、"source" 和 "articles"（各条的章/节/条路径）的文本块记录
+    :return: (来源, 章序号, 节序号, 条序号, 块id) 列表
+    """
+    return [
+        (record["source"], marker_number(path["chapter"]) or 0, marker_number(path["section"]) or 0,
+         marker_number(path["article"]), record["id"])
+        for path in record.get("articles", ())
+    ]
+
+
+def parse_article_references(question):
+    """
+    解析问题中的全部条文引用，例如“第三条和第五条有什么区别”中的两条。
+    :return: {"chapter", "section", "article"} 序号字典列表（未指定的章、节为 None），按出现顺序去重
+    """
+    references = []
+    for match in ARTICLE_REFERENCE.finditer(question):
+        chapter, section, article = (parse_numeral(group) if group else None for group in match.groups())
+        reference = {"chapter": chapter, "section": section, "article": article}
+        if article is not None and reference not in references:
+            references.append(reference)
+    return references
+
+
+def extract_article_text(chunk_text, start_path, chapter_no, section_no, article_no):
+    """从文本块中截取指定条的内容，文本块中找不到该条时返回 None。"""
+    path = {field: start_path.get(field) for field in STRUCTURE_PATH_FIELDS}
+    parts, previous = [], ""
+    for _, section in iter_sections([(None, chunk_text)], len(chunk_text) + 1):
+        update_structure_path(path, section, previous)
+        previous = section
+        if (marker_number(path["article"]) == article_no
+                and (marker_number(path["chapter"]) or 0) == chapter_no
+                and (marker_number(path["section"]) or 0) == section_no):
+            parts.append(section)
+    return "".join(parts).strip() or None
+
+
+def lookup_article(question, collection_name, sources=None):
+    """
+    直接从条文索引回答“第X条”类问题，不调用嵌入接口和向量检索。问题引用多条时逐条查找。
+    :param question: 问题文本
+    :param collection_name: 集合名称
+    :param sources: 限定的来源文件名列表，可选
+    :return: 条文原文（多条、多个文档时分段），问题中没有条文引用或任何一条在索引中找不到时返回 None，
+             由调用方退回向量检索，避免只基于部分条文回答
+    """
+    references = parse_article_references(question)
+    if not references:
+        return None
+    chunk_store = get_chunk_store()
+    parts = []
+    for reference in references:
+        text = _lookup_reference(chunk_store, collection_name, reference, sources)
+        if text is None:
+            return None
+        parts.append(text)
+    return "\n\n".join(parts)
+
+
+def _lookup_reference(chunk_store, collection_name, reference, sources):
+    """查找一条引用的原文，找不到时返回 None。"""
+    rows = chunk_store.find_articles(collection_name, reference["article"], reference["chapter"],
+                                     reference["section"], sources)
+    if not rows:
+        return None
+
+    groups = {}
+    for source, chapter_no, section_no, chunk_id in rows:
+        groups.setdefault((source, chapter_no, section_no), []).append(chunk_id)
+    selected = list(groups.items())[:MAX_ARTICLE_SOURCES]
+    chunks = chunk_store.get_many(collection_name, [chunk_id for _, chunk_ids in selected for chunk_id in chunk_ids])
+
+    parts = []
+    for (source, chapter_no, section_no), chunk_ids in selected:
+        # 索引指向的文本块中截取不到该条时跳过，全部截取不到时视为找不到
+        texts = (
+            extract_article_text(chunks[chunk_id]["text"], chunks[chunk_id]["metadata"],
+                                 chapter_no, section_no, reference["article"])
+            for chunk_id in chunk_ids if chunk_id in chunks
+        )
+        text = "".join(filter(None, texts))
+        if text:
+            parts.append(f"《{source}》\n{text}")
+    return "\n\n".join(parts) or None
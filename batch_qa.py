@@ -0,0 +1,217 @@
+"""
+批量问答：从 JSONL/CSV 读取问题，经与页面相同的检索和回答流程生成答案，逐条写入 JSONL。
+
+    python batch_qa.py questions.jsonl answers.jsonl --collection my_collection --concurrency 4
+
+输入每行（或每个 CSV 行）至少包含 question 字段，可选 id 和 task_type；缺少 id 时使用行号。
+API 密钥默认读取环境变量 DASHSCOPE_API_KEY、DASHVECTOR_API_KEY 和 DASHVECTOR_ENDPOINT。
+中断后用相同命令重跑即可续跑：输出文件中已成功回答的 id 会被跳过，失败的条目会重新回答并追加到文件末尾。
+"""
+import os
+import csv
+import json
+import time
+import argparse
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import dashscope
+from embedding_web import QueryEmbeddingCache, MAX_BATCH_SIZE
+from model_router import AUTO_MODEL, DEFAULT_LATENCY_BUDGET, generate
+from prompts import GovernmentAgentPrompts
+from qa_pipeline import retrieve_context, retrieve_contexts, answer_question
+
+DEFAULT_CONCURRENCY = 4
+# 每个窗口先批量检索上下文再并发生成回答，中断时最多丢失一个窗口内在途的条目
+WINDOW_SIZE = 4 * MAX_BATCH_SIZE
+
+
+def load_questions(path):
+    """
+    读取问题文件，支持 JSONL 和 CSV（需有 question 列）。
+    :return: {"id", "question", "task_type"} 列表，id 统一为字符串
+    """
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    items = []
+    for line_no, row in enumerate(rows, 1):
+        question = (row.get("question") or "").strip()
+        if not question:
+            print(f"Skipping row {line_no}: empty question")
+            continue
+        items.append({"id": str(row.get("id") or line_no), "question": question, "task_type": row.get("task_type")})
+    return items
+
+
+def load_answered_ids(path):
+    """读取已有输出文件中成功回答的 id，用于断点续跑。"""
+    answered = set()
+    if not os.path.exists(path):
+        return answered
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断时可能写了半行
+                continue
+            if "error" not in record:
+                answered.add(str(record["id"]))
+    return answered
+
+
+class BatchAnswerer:
+    """
+    批量回答问题，整个批次共享问题向量缓存和检索结果缓存。
+    :param option: "RAG" 或 "Default"，与页面上的选项含义相同
+    :param concurrency: 同时处理的问题数
+    """
+
+    def __init__(self, option, model, dashvector_api_key, dashvector_endpoint, collection_name,
+                 default_task_type="通用问答", concurrency=DEFAULT_CONCURRENCY, latency_budget=DEFAULT_LATENCY_BUDGET):
+        self.option = option
+        self.model = model
+        self.dashvector_api_key = dashvector_api_key
+        self.dashvector_endpoint = dashvector_endpoint
+        self.collection_name = collection_name
+        self.default_task_type = default_task_type
+        self.concurrency = concurrency
+        self.latency_budget = latency_budget
+        self.embedding_cache = QueryEmbeddingCache()
+        self._contexts = {}
+
+    def run(self, items):
+        """
+        回答全部问题。
+        :return: 结果记录生成器，按完成顺序产出
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for start in range(0, len(items), WINDOW_SIZE):
+                window = [dict(item, prompt=GovernmentAgentPrompts.generate_response(
+                    item["task_type"] or self.default_task_type, item["question"]))
+                    for item in items[start:start + WINDOW_SIZE]]
+                if self.option == "RAG":
+                    self._retrieve_window(window)
+                futures = [executor.submit(self.answer, item) for item in window]
+                for future in as_completed(futures):
+                    yield future.result()
+
+    def _retrieve_window(self, window):
+        """
+        批量检索窗口内问题的上下文：问题向量每 MAX_BATCH_SIZE 条合并为一次 TextEmbedding 调用，
+        相同的问题在整个批次内只检索一次。结果和平摊到每个问题的检索耗时写入 item。
+        """
+        keys = [(item["prompt"], item["question"]) for item in window]
+        missing = [key for key in dict.fromkeys(keys) if key not in self._contexts]
+        start = time.monotonic()
+        if missing:
+            try:
+                contexts = retrieve_contexts([prompt for prompt, _ in missing], [question for _, question in missing],
+                                             self.dashvector_api_key, self.dashvector_endpoint, self.collection_name,
+                                             embedding_cache=self.embedding_cache)
+            except Exception as e:
+                print(f"Batch retrieval failed: {e}, retrying one by one")
+                contexts = [self._retrieve_one(prompt, question) for prompt, question in missing]
+            self._contexts.update(zip(missing, contexts))
+        retrieval_ms = (time.monotonic() - start) * 1000 / len(missing) if missing else 0.0
+
+        retrieved = set()
+        for item, key in zip(window, keys):
+            item["context"] = self._contexts[key]
+            item["context_cached"] = key not in missing or key in retrieved
+            item["retrieval_ms"] = 0.0 if item["context_cached"] else retrieval_ms
+            retrieved.add(key)
+
+    def _retrieve_one(self, prompt, question):
+        try:
+            return retrieve_context(prompt, question, self.dashvector_api_key, self.dashvector_endpoint,
+                                    self.collection_name)
+        except Exception as e:
+            return e
+
+    def answer(self, item):
+        record = {"id": item["id"], "question": item["question"],
+                  "task_type": item["task_type"] or self.default_task_type, "model": self.model}
+        timings = {}
+        routing = {"question": item["question"], "task_type": record["task_type"], "latency_budget": self.latency_budget}
+        start = time.monotonic()
+        try:
+            if self.option == "RAG":
+                timings["retrieval_ms"] = round(item["retrieval_ms"], 1)
+                record["context_cached"] = item["context_cached"]
+                if isinstance(item["context"], Exception):
+                    raise item["context"]
+                errors = []
+                answer = answer_question(item["prompt"], item["context"], self.model, routing,
+                                         on_error=errors.append)
+                if errors:
+                    raise RuntimeError(errors[0])
+            else:
+                rsp = generate(self.model, messages=[{"role": "user", "content": item["prompt"]}],
+                               result_format='message', **routing)
+                if rsp.status_code != HTTPStatus.OK:
+                    raise RuntimeError(f"Request id: {rsp.request_id}, Status code: {rsp.status_code}, "
+                                       f"error code: {rsp.code}, error message: {rsp.message}")
+                answer = rsp.output.choices[0]['message']['content']
+            record["answer"] = answer
+            timings["generation_ms"] = round((time.monotonic() - start) * 1000, 1)
+        except Exception as e:
+            print(f"Question {item['id']} failed: {e}")
+            record["error"] = str(e)
+        timings["total_ms"] = round((time.monotonic() - start) * 1000 + item.get("retrieval_ms", 0.0), 1)
+        record["timings"] = timings
+        return record
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="批量问答：从 JSONL/CSV 读取问题，回答写入 JSONL，支持断点续跑")
+    parser.add_argument("input", help="问题文件（.jsonl 或 .csv）")
+    parser.add_argument("output", help="回答输出文件（.jsonl），已存在时跳过其中已成功回答的问题")
+    parser.add_argument("--collection", default="default_collection", help="DashVector 集合名称")
+    parser.add_argument("--option", choices=["RAG", "Default"], default="RAG")
+    parser.add_argument("--model", default="qwen-turbo", help=f"模型名称，{AUTO_MODEL} 为自动路由")
+    parser.add_argument("--task-type", default="通用问答", choices=list(GovernmentAgentPrompts.TASK_PROMPTS),
+                        help="问题未指定 task_type 时使用的任务类型")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--latency-budget", type=float, default=DEFAULT_LATENCY_BUDGET,
+                        help="自动路由时每个问题生成回答的延迟预算（秒），含改用后备模型的重试")
+    parser.add_argument("--dashscope-api-key", default=os.getenv("DASHSCOPE_API_KEY"))
+    parser.add_argument("--dashvector-api-key", default=os.getenv("DASHVECTOR_API_KEY"))
+    parser.add_argument("--dashvector-endpoint", default=os.getenv("DASHVECTOR_ENDPOINT"))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.dashscope_api_key:
+        raise SystemExit("Missing DashScope API key (--dashscope-api-key or DASHSCOPE_API_KEY)")
+    if args.option == "RAG" and not (args.dashvector_api_key and args.dashvector_endpoint):
+        raise SystemExit("RAG mode needs --dashvector-api-key and --dashvector-endpoint "
+                         "(or DASHVECTOR_API_KEY / DASHVECTOR_ENDPOINT)")
+    dashscope.api_key = args.dashscope_api_key
+
+    items = load_questions(args.input)
+    answered = load_answered_ids(args.output)
+    pending = [item for item in items if item["id"] not in answered]
+    print(f"{len(items)} question(s), {len(items) - len(pending)} already answered, {len(pending)} to go")
+
+    answerer = BatchAnswerer(args.option, args.model, args.dashvector_api_key, args.dashvector_endpoint,
+                             args.collection, args.task_type, args.concurrency, args.latency_budget)
+    done = failed = 0
+    start = time.monotonic()
+    with open(args.output, "a", encoding="utf-8") as f:
+        for record in answerer.run(pending):
+            # 每条结果立即落盘，中断后可从此处续跑
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            done += 1
+            failed += "error" in record
+            print(f"[{done}/{len(pending)}] {record['id']} "
+                  f"{'failed' if 'error' in record else 'ok'} {record['timings']['total_ms']:.0f} ms")
+    print(f"Finished {done} question(s) in {time.monotonic() - start:.1f}s, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
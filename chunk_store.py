@@ -0,0 +1,219 @@
+import os
+import json
+import sqlite3
+import threading
+
+# 文本块存储位置，可通过环境变量覆盖。向量库只保存 id 和元数据，原文和入库任务表都在这个文件里，
+# 它必须持久保存（容器部署时挂载为卷，见 Dockerfile），丢失后检索只能得到 id，需要重新入库
+CHUNK_STORE_PATH = os.environ.get("CHUNK_STORE_PATH", "chunk_store.db")
+# SQLite 单条语句的参数个数有限制，批量查询时按此大小分段
+LOOKUP_BATCH_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    collection TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    source TEXT,
+    metadata TEXT,
+    PRIMARY KEY (collection, chunk_id)
+);
+CREATE TABLE IF NOT EXISTS chunk_sources (
+    collection TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (collection, chunk_id, source)
+);
+CREATE TABLE IF NOT EXISTS articles (
+    collection TEXT NOT NULL,
+    source TEXT NOT NULL,
+    chapter_no INTEGER NOT NULL,
+    section_no INTEGER NOT NULL,
+    article_no INTEGER NOT NULL,
+    chunk_id TEXT NOT NULL,
+    PRIMARY KEY (collection, source, chapter_no, section_no, article_no, chunk_id)
+);
+CREATE TABLE IF NOT EXISTS embedded_chunks (
+    collection TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    PRIMARY KEY (collection, chunk_id)
+);
+"""
+
+
+class ChunkStore:
+    """
+    本地文本块存储：按 (集合名, 块id) 保存原文与来源，向量库中只保存 id 和少量元数据。
+    :param path: SQLite 数据库文件路径
+    """
+
+    def __init__(self, path=CHUNK_STORE_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def put_many(self, collection, records):
+        """
+        写入一批文本块。
+        :param collection: 集合名称
+        :param records: 记录列表，每条包含 "id"、"text"，可选 "source"、"metadata"
+        """
+        rows = [
+            (collection, record["id"], record["text"], record.get("source"),
+             json.dumps(record.get("metadata") or {}, ensure_ascii=False))
+            for record in records
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (collection, chunk_id, text, source, metadata) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunk_sources (collection, chunk_id, source) VALUES (?, ?, ?)",
+                [(collection, record["id"], record["source"]) for record in records if record.get("source")]
+            )
+
+    def add_source(self, collection, chunk_id, source):
+        """为已有文本块追加一个来源引用（用于被去重合并的重复块）。"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO chunk_sources (collection, chunk_id, source) VALUES (?, ?, ?)",
+                (collection, chunk_id, source)
+            )
+
+    def get_sources(self, collection, chunk_id):
+        """返回文本块的全部来源。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source FROM chunk_sources WHERE collection = ? AND chunk_id = ? ORDER BY source",
+                (collection, chunk_id)
+            )
+            return [source for source, in rows]
+
+    def put_articles(self, collection, rows):
+        """
+        写入条文索引。
+        :param rows: (来源, 章序号, 节序号, 条序号, 块id) 列表，没有章或节时序号为 0
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO articles (collection, source, chapter_no, section_no, article_no, chunk_id) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(collection,) + tuple(row) for row in rows]
+            )
+
+    def find_articles(self, collection, article_no, chapter_no=None, section_no=None, sources=None):
+        """
+        按条序号查找文本块。
+        :return: (来源, 章序号, 节序号, 块id) 列表，按写入顺序排列
+        """
+        clause = "collection = ? AND article_no = ?"
+        params = [collection, article_no]
+        if chapter_no is not None:
+            clause += " AND chapter_no = ?"
+            params.append(chapter_no)
+        if section_no is not None:
+            clause += " AND section_no = ?"
+            params.append(section_no)
+        if sources:
+            clause += f" AND source IN ({','.join('?' * len(sources))})"
+            params.extend(sources)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT source, chapter_no, section_no, chunk_id FROM articles WHERE {clause} ORDER BY rowid", params)
+            return rows.fetchall()
+
+    def list_sources(self, collection):
+        """返回集合中出现过的全部来源文件名。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT source FROM chunk_sources WHERE collection = ? ORDER BY source", (collection,))
+            return [source for source, in rows]
+
+    def shared_chunk_ids(self, collection, sources):
+        """
+        返回来源包含 sources、但首个来源（即向量上记录的 source）不在其中的已入库文本块 id。
+        这些块是被去重合并的共享文本块，按文件过滤时需要按 id 放行。
+        """
+        if isinstance(sources, str):
+            sources = [sources]
+        placeholders = ",".join("?" * len(sources))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT s.chunk_id FROM chunk_sources s "
+                "JOIN chunks c ON c.collection = s.collection AND c.chunk_id = s.chunk_id "
+                "JOIN embedded_chunks e ON e.collection = s.collection AND e.chunk_id = s.chunk_id "
+                f"WHERE s.collection = ? AND s.source IN ({placeholders}) AND c.source NOT IN ({placeholders})",
+                [collection, *sources, *sources])
+            return [chunk_id for chunk_id, in rows]
+
+    def mark_embedded(self, collection, chunk_ids):
+        """记录已写入向量库的文本块，作为入库任务的检查点。"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embedded_chunks (collection, chunk_id) VALUES (?, ?)",
+                [(collection, chunk_id) for chunk_id in chunk_ids]
+            )
+
+    def embedded_ids(self, collection):
+        """返回集合中已写入向量库的文本块 id 集合。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT chunk_id FROM embedded_chunks WHERE collection = ?", (collection,))
+            return {chunk_id for chunk_id, in rows}
+
+    def get_many(self, collection, chunk_ids):
+        """
+        批量读取文本块。
+        :param collection: 集合名称
+        :param chunk_ids: 块 id 列表
+        :return: {块id: {"text", "source", "metadata"}}，不存在的 id 不出现在结果中
+        """
+        chunk_ids = list(chunk_ids)
+        result = {}
+        with self._lock:
+            for start in range(0, len(chunk_ids), LOOKUP_BATCH_SIZE):
+                batch = chunk_ids[start:start + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT chunk_id, text, source, metadata FROM chunks "
+                    f"WHERE collection = ? AND chunk_id IN ({placeholders})",
+                    [collection] + batch
+                )
+                for chunk_id, text, source, metadata in rows:
+                    result[chunk_id] = {"text": text, "source": source, "metadata": json.loads(metadata or "{}")}
+        return result
+
+    def get_texts(self, collection, chunk_ids):
+        """
+        批量读取文本块原文。
+        :return: 与 chunk_ids 对齐的文本列表，不存在的位置为 None
+        """
+        found = self.get_many(collection, chunk_ids)
+        return [found[chunk_id]["text"] if chunk_id in found else None for chunk_id in chunk_ids]
+
+    def clear_collection(self, collection):
+        """删除某个集合的全部文本块。"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE collection = ?", (collection,))
+            self._conn.execute("DELETE FROM chunk_sources WHERE collection = ?", (collection,))
+            self._conn.execute("DELETE FROM embedded_chunks WHERE collection = ?", (collection,))
+            self._conn.execute("DELETE FROM articles WHERE collection = ?", (collection,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_chunk_store(path=CHUNK_STORE_PATH):
+    """获取进程内共享的 ChunkStore 实例。"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ChunkStore(path)
+        return _stores[path]
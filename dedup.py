@@ -0,0 +1,183 @@
+import re
+import hashlib
+import numpy as np
+from text_structure import CHINESE_NUMERALS
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 4
+# 汉明距离不超过该值的两个文本块才进入精确比对（长文本的上限，短文本按长度收紧，见 allowed_distance）
+NEAR_DUPLICATE_DISTANCE = 6
+# 每多少个字符允许 1 位汉明距离
+CHARS_PER_DISTANCE_BIT = 150
+# 精确比对：shingle 集合的 Jaccard 相似度（由 MinHash 签名估计）不低于该值才合并
+NEAR_DUPLICATE_JACCARD = 0.95
+# MinHash 签名长度：每个文本块只保存固定大小的签名而非原文，Jaccard 估计的标准差约为 sqrt(J(1-J)/128)
+MINHASH_PERMUTATIONS = 128
+# 每个“排列”是 shingle 哈希与一个随机种子异或后再经 splitmix64 打散，uint64 乘法按 2^64 取模
+_MINHASH_SEEDS = np.random.default_rng(20240601).integers(
+    0, np.iinfo(np.uint64).max, MINHASH_PERMUTATIONS, dtype=np.uint64, endpoint=True)
+# 将 64 位指纹分成 8 段，距离 <= 6 的两个指纹至少有一段完全相同（抽屉原理）
+_BANDS = 8
+_BAND_BITS = SIMHASH_BITS // _BANDS
+# 数字（含中文数字）和章/节/条标记，近似重复的两个文本块必须完全一致，避免合并只有金额、年份或条号不同的文本
+_NUMBER = re.compile(rf'[\d{CHINESE_NUMERALS}万亿]+')
+_STRUCTURE_MARKER = re.compile(rf'第[\d{CHINESE_NUMERALS}]+[章节条]')
+
+
+def normalize_chunk(text):
+    """去掉空白并统一大小写，使排版差异不影响重复判断。"""
+    return re.sub(r'\s+', '', text).lower()
+
+
+def content_hash(text):
+    """归一化文本的内容哈希，同时用作文本块 id。"""
+    return hashlib.blake2b(normalize_chunk(text).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def simhash(text, shingle_size=SHINGLE_SIZE):
+    """
+    计算文本的 SimHash 指纹（按字符 shingle，适用于中文）。
+    :param text: 文本
+    :param shingle_size: shingle 长度
+    :return: 64 位整数指纹
+    """
+    normalized = normalize_chunk(text)
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles(normalized, shingle_size):
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def shingles(normalized, shingle_size=SHINGLE_SIZE):
+    return {normalized[i:i + shingle_size] for i in range(max(1, len(normalized) - shingle_size + 1))}
+
+
+def _splitmix64(x):
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def minhash(normalized, shingle_size=SHINGLE_SIZE):
+    """
+    计算 shingle 集合的 MinHash 签名。
+    :return: 长度为 MINHASH_PERMUTATIONS 的 uint64 数组
+    """
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+         for shingle in shingles(normalized, shingle_size)),
+        dtype=np.uint64
+    )
+    return _splitmix64(_MINHASH_SEEDS[:, None] ^ hashes[None, :]).min(axis=1)
+
+
+def estimate_jaccard(a, b):
+    """由两个 MinHash 签名估计 Jaccard 相似度。"""
+    return float(np.mean(a == b))
+
+
+def allowed_distance(length, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """按文本长度确定允许的汉明距离：同样的改动在短文本中占比更大，指纹变化也更大。"""
+    return min(max_distance, length // CHARS_PER_DISTANCE_BIT)
+
+
+def numeric_signature(normalized):
+    """文本中数字序列和章/节/条标记序列的摘要，两个文本的摘要相同即两个序列都完全一致。"""
+    numbers = "\x1f".join(_NUMBER.findall(normalized))
+    markers = "\x1f".join(_STRUCTURE_MARKER.findall(normalized))
+    return hashlib.blake2b(f"{numbers}\x1e{markers}".encode("utf-8"), digest_size=16).digest()
+
+
+class ChunkDeduplicator:
+    """
+    在嵌入前合并完全重复和近似重复的文本块，重复块复用首次出现的块 id。
+    SimHash 分段命中只作为候选，合并前还要求 shingle Jaccard 相似度足够高，且数字和章/节/条标记序列完全一致。
+    每个首次出现的文本块只保存固定大小的 MinHash 签名和数字摘要，内存占用不随文本块长度增长。
+    :param max_distance: 长文本判定为近似重复候选的最大汉明距离
+    :param min_jaccard: 合并所需的最小 shingle Jaccard 相似度
+    :param shingle_size: SimHash 的 shingle 长度，短于该长度的文本只做精确去重
+    """
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE, min_jaccard=NEAR_DUPLICATE_JACCARD,
+                 shingle_size=SHINGLE_SIZE):
+        self.max_distance = max_distance
+        self.min_jaccard = min_jaccard
+        self.shingle_size = shingle_size
+        self.total = 0
+        self.duplicates = 0
+        self._exact = {}
+        self._bands = [{} for _ in range(_BANDS)]
+        # 首次出现的文本块的 (MinHash 签名, 数字摘要)，供精确比对
+        self._signatures = {}
+
+    def check(self, text):
+        """
+        登记一个文本块。
+        :param text: 文本块
+        :return: (块 id, 是否重复)，重复时返回已有块的 id
+        """
+        self.total += 1
+        digest = content_hash(text)
+        if digest in self._exact:
+            self.duplicates += 1
+            return self._exact[digest], True
+
+        normalized = normalize_chunk(text)
+        if len(normalized) >= self.shingle_size:
+            fingerprint = simhash(text, self.shingle_size)
+            keys = [fingerprint >> (i * _BAND_BITS) & ((1 << _BAND_BITS) - 1) for i in range(_BANDS)]
+            max_distance = allowed_distance(len(normalized), self.max_distance)
+            signature = (minhash(normalized, self.shingle_size), numeric_signature(normalized))
+            checked = set()
+            for band, key in zip(self._bands, keys):
+                for candidate, chunk_id in band.get(key, ()):
+                    if chunk_id in checked or hamming_distance(fingerprint, candidate) > max_distance:
+                        continue
+                    checked.add(chunk_id)
+                    if self._is_near_duplicate(signature, self._signatures[chunk_id]):
+                        self._exact[digest] = chunk_id
+                        self.duplicates += 1
+                        return chunk_id, True
+            for band, key in zip(self._bands, keys):
+                band.setdefault(key, []).append((fingerprint, digest))
+            self._signatures[digest] = signature
+
+        self._exact[digest] = digest
+        return digest, False
+
+    def _is_near_duplicate(self, a, b):
+        (minhash_a, numbers_a), (minhash_b, numbers_b) = a, b
+        if numbers_a != numbers_b:
+            return False
+        return estimate_jaccard(minhash_a, minhash_b) >= self.min_jaccard
+
+    @property
+    def dedup_ratio(self):
+        return self.duplicates / self.total if self.total else 0.0
+
+
+def deduplicate_chunks(records, deduplicator, on_duplicate=None):
+    """
+    去重阶段：为每条记录分配块 id，只产出首次出现的记录。
+    :param records: 包含 "text" 键的记录可迭代对象
+    :param deduplicator: ChunkDeduplicator 实例
+    :param on_duplicate: 遇到重复块时的回调，参数为 (已有块 id, 重复记录)
+    :return: 去重后的记录生成器
+    """
+    for record in records:
+        record["id"], duplicate = deduplicator.check(record["text"])
+        if not duplicate:
+            yield record
+        elif on_duplicate:
+            on_duplicate(record["id"], record)
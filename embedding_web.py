@@ -5,11 +5,41 @@ import streamlit as st
 from dashscope import TextEmbedding
 from dashvector import Client, Doc
 import re
+import time
+import random
+import threading
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import OrderedDict
 from tqdm import tqdm
+from chunk_store import get_chunk_store
+from dedup import ChunkDeduplicator, content_hash, deduplicate_chunks
+from loaders import iter_document, list_documents
+from text_structure import iter_structured_chunks
+from article_index import article_index_rows
 
 MAX_INPUT_LENGTH = 2048
 MAX_BATCH_SIZE = 25
 
+# DashScope text-embedding-v2 的默认限流配额（每秒请求数），按账号实际配额调整
+EMBEDDING_RATE_LIMIT = 25
+EMBEDDING_MAX_WORKERS = 8
+EMBEDDING_MAX_RETRIES = 5
+EMBEDDING_BACKOFF_BASE = 1.0
+
+# 文本块元数据字段及类型，创建集合时声明，检索时可在向量库中直接按这些字段过滤
+CHUNK_FIELDS_SCHEMA = {
+    "source": str,
+    "page": int,
+    "chapter": str,
+    "section": str,
+    "article": str,
+    "doc_date": str,
+    "year": int,
+    # 文本块 id，按文件过滤时用来放行被去重合并、首个来源不是该文件的共享文本块
+    "chunk_id": str,
+}
+
 def list_pdf_files(pdf_folder_path):
     pdf_files = []
     if os.path.isdir(pdf_folder_path):
@@ -35,7 +65,7 @@ def extract_text_from_pdf(pdf_path):
 def clean_text(text):
     """Clean the extracted text."""
     text = re.sub(r'\s+', ' ', text)  # Replace multiple spaces with a single space
-    text = re.sub(r'[^\x00-\x7F]+', '', text)  # Remove non-ASCII characters
+    text = re.sub(r'[\x00-\x1f\x7f\ufffd]+', '', text)  # Remove control and replacement characters
     text = text.strip()  # Remove leading and trailing whitespace
     return text
 
@@ -43,23 +73,74 @@ def split_text(text, max_length=MAX_INPUT_LENGTH):
     """Split text into chunks of max_length."""
     return [text[i:i+max_length] for i in range(0, len(text), max_length)]
 
-def prepare_data(path, max_batch_size=MAX_BATCH_SIZE):
+def infer_document_date(name, text):
+    """
+    从文件名或正文开头推断文档日期。
+    :return: "YYYY-MM-DD" 或 "YYYY"，无法推断时返回 None
+    """
+    match = re.search(r'((?:19|20)\d{2})年(\d{1,2})月(\d{1,2})日', text)
+    if match:
+        year, month, day = match.groups()
+        return f"{year}-{int(month):02d}-{int(day):02d}"
+    match = re.search(r'(?:19|20)\d{2}', name) or re.search(r'((?:19|20)\d{2})年', text)
+    if match:
+        return match.group(1) if match.groups() else match.group()
+    return None
+
+def chunk_metadata(name, page, path, doc_date):
+    """组装文本块元数据，省略为空的字段。"""
+    metadata = {"source": name, "page": page, **path, "doc_date": doc_date,
+                "year": int(doc_date[:4]) if doc_date else None}
+    return {key: value for key, value in metadata.items() if value is not None}
+
+def iter_document_chunks(source, name, chunk_size=1000):
+    """
+    逐页读取一个文档并按章/节/条结构产出文本块记录，整篇文档不会一次性读入内存。
+    :param source: 文件路径或上传的文件对象
+    :param name: 文件名，记为文本块的来源
+    :return: 包含 "text"、"source"、"articles"（包含的各条）和 "metadata"（来源、页码、章/节/条、文档日期）的记录生成器
+    """
+    pages = ((page, clean_text(page_text) + " ") for page, page_text in iter_document(source, name))
+    first_page = next(pages, None)
+    if first_page is None:
+        return
+    doc_date = infer_document_date(name, first_page[1])
+
+    def all_pages():
+        yield first_page
+        yield from pages
+
+    for chunk in iter_structured_chunks(all_pages(), chunk_size):
+        text = chunk["text"].strip()
+        if text:
+            yield {"text": text, "source": name, "articles": chunk["articles"],
+                   "metadata": chunk_metadata(name, chunk["page"], chunk["path"], doc_date)}
+
+def list_sources(pdf_folder_path=None, uploaded_files=None):
+    """返回待处理的 (文件路径或文件对象, 文件名) 列表：优先使用上传的文件，否则读取文件夹。"""
+    if uploaded_files:
+        return [(uploaded_file, uploaded_file.name) for uploaded_file in uploaded_files]
+    return [(os.path.join(pdf_folder_path, file), file) for file in list_documents(pdf_folder_path)]
+
+def iter_chunks(path):
+    """逐个产出文件夹内文档的文本块记录，每条记录包含 "text" 和来源文件名 "source"。"""
+    for source, name in tqdm(list_sources(path), desc="Processing documents"):
+        yield from iter_document_chunks(source, name)
+
+def batch_records(records, max_batch_size=MAX_BATCH_SIZE):
     batch_docs = []
-    files = [file for file in os.listdir(path) if file.endswith('.pdf')]
-
-    for file in tqdm(files, desc="Processing PDFs"):
-        file_path = os.path.join(path, file)
-        text = extract_text_from_pdf(file_path)
-        cleaned_text = clean_text(text)
-        chunks = split_text(cleaned_text)
-        for chunk in chunks:
-            batch_docs.append(chunk)
-            if len(batch_docs) == max_batch_size:
-                yield batch_docs
-                batch_docs = []
+    for record in records:
+        batch_docs.append(record)
+        if len(batch_docs) == max_batch_size:
+            yield batch_docs
+            batch_docs = []
     if batch_docs:
         yield batch_docs
 
+def prepare_data(path, max_batch_size=MAX_BATCH_SIZE):
+    """按批产出文本块记录，每条记录包含 "text" 和来源文件名 "source"。"""
+    return batch_records(iter_chunks(path), max_batch_size)
+
 def generate_embeddings(news):
     try:
         rsp = TextEmbedding.call(
@@ -79,7 +160,236 @@ def generate_embeddings(news):
         return None
 
 
-def vectorize_and_store(api_key, endpoint_api_key, endpoint, pdf_folder_path, collection_name):
+def call_embedding_api(texts):
+    """调用 TextEmbedding 接口并返回原始响应，由调用方根据状态码处理错误。"""
+    return TextEmbedding.call(
+        model=TextEmbedding.Models.text_embedding_v2,
+        input=texts
+    )
+
+
+def _is_throttling_error(rsp):
+    return rsp.status_code == HTTPStatus.TOO_MANY_REQUESTS or str(rsp.code).startswith("Throttling")
+
+
+def _is_oversized_error(rsp):
+    message = str(rsp.message).lower()
+    return rsp.code == "InvalidParameter" and ("length" in message or "batch" in message or "size" in message)
+
+
+class TokenBucket:
+    """
+    令牌桶限流器：以 rate 个/秒的速度补充令牌，最多积累 capacity 个。
+    :param rate: 每秒补充的令牌数
+    :param capacity: 桶容量，默认等于 rate
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到取得一个令牌。"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class EmbeddingScheduler:
+    """
+    按 DashScope 配额限流的并发嵌入调度器。
+    限流错误按指数退避重试，输入过大时自动拆分批次，最终失败的文本块记入 dead_letters，不会被静默丢弃。
+    :param rate_limit: 每秒最多发出的请求数
+    :param max_workers: 同时在途的请求数
+    :param max_retries: 单个批次的最大重试次数
+    :param backoff_base: 指数退避的基础等待秒数
+    """
+
+    def __init__(self, rate_limit=EMBEDDING_RATE_LIMIT, max_workers=EMBEDDING_MAX_WORKERS,
+                 max_retries=EMBEDDING_MAX_RETRIES, backoff_base=EMBEDDING_BACKOFF_BASE):
+        self.bucket = TokenBucket(rate_limit)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.dead_letters = []
+        self._dead_letter_lock = threading.Lock()
+
+    def embed(self, texts):
+        """
+        为一批文本生成嵌入向量。
+        :param texts: 文本列表
+        :return: 与 texts 对齐的向量列表，最终失败的位置为 None
+        """
+        vectors = [None] * len(texts)
+        self._embed_into(texts, 0, vectors)
+        return vectors
+
+    def _embed_into(self, texts, offset, vectors):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                rsp = call_embedding_api(texts)
+            except Exception as e:
+                error = str(e)
+                retryable = True
+            else:
+                if rsp.status_code == HTTPStatus.OK and rsp.output and 'embeddings' in rsp.output:
+                    for i, record in enumerate(rsp.output['embeddings']):
+                        vectors[offset + record.get('text_index', i)] = record['embedding']
+                    # 响应中缺少的向量同样记入 dead_letters，不会在写入向量库时被悄悄跳过
+                    missing = [i for i in range(len(texts)) if vectors[offset + i] is None]
+                    if missing:
+                        self._dead_letter([texts[i] for i in missing],
+                                          f"response returned {len(texts) - len(missing)} of {len(texts)} embeddings")
+                    return
+                error = f"{rsp.code}: {rsp.message}"
+                if _is_oversized_error(rsp):
+                    if len(texts) > 1:
+                        # 批次过大：对半拆分后分别重试
+                        mid = len(texts) // 2
+                        self._embed_into(texts[:mid], offset, vectors)
+                        self._embed_into(texts[mid:], offset + mid, vectors)
+                        return
+                    break
+                retryable = _is_throttling_error(rsp) or rsp.status_code >= 500
+            if not retryable or attempt == self.max_retries:
+                break
+            time.sleep(self.backoff_base * 2 ** attempt + random.uniform(0, self.backoff_base))
+
+        self._dead_letter(texts, error)
+
+    def _dead_letter(self, texts, error):
+        print(f"Embedding failed for {len(texts)} chunk(s): {error}")
+        with self._dead_letter_lock:
+            self.dead_letters.extend({"text": text, "error": error} for text in texts)
+
+    def map_batches(self, batches):
+        """
+        并发嵌入各批次，按完成顺序产出 (batch, vectors)。
+        :param batches: 批次的可迭代对象，每个批次是包含 "text" 键的记录列表
+        :return: (batch, vectors) 生成器，vectors 与 batch 对齐，失败的位置为 None
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+            for batch in batches:
+                pending.add(executor.submit(self._embed_batch, batch))
+                # 限制在途批次数量，避免一次性把全部语料读入内存
+                if len(pending) >= self.max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    def _embed_batch(self, batch):
+        return batch, self.embed([record["text"] for record in batch])
+
+
+class QueryEmbeddingCache:
+    """
+    问题向量缓存（LRU），线程安全，同一批次或同一会话中重复的问题只调用一次嵌入接口。
+    :param max_size: 最多缓存的问题数
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text):
+        with self._lock:
+            vector = self._vectors.get(text)
+            if vector is not None:
+                self._vectors.move_to_end(text)
+            return vector
+
+    def put(self, text, vector):
+        with self._lock:
+            self._vectors[text] = vector
+            self._vectors.move_to_end(text)
+            while len(self._vectors) > self.max_size:
+                self._vectors.popitem(last=False)
+
+
+def embed_queries(texts, cache=None, scheduler=None, max_batch_size=MAX_BATCH_SIZE):
+    """
+    批量生成问题向量：缓存未命中的问题去重后每 max_batch_size 个合并为一次 TextEmbedding 调用。
+    :param texts: 问题文本列表
+    :param cache: QueryEmbeddingCache，可选
+    :param scheduler: EmbeddingScheduler，负责限流和重试，默认新建一个
+    :return: 与 texts 对齐的向量列表，失败的位置为 None
+    """
+    scheduler = scheduler or EmbeddingScheduler()
+    vectors = {}
+    if cache is not None:
+        for text in texts:
+            vector = cache.get(text)
+            if vector is not None:
+                vectors[text] = vector
+    missing = [text for text in dict.fromkeys(texts) if text not in vectors]
+    batches = [missing[i:i + max_batch_size] for i in range(0, len(missing), max_batch_size)]
+    for batch, batch_vectors in scheduler.map_batches([{"text": text} for text in batch] for batch in batches):
+        for record, vector in zip(batch, batch_vectors):
+            if vector is not None:
+                vectors[record["text"]] = vector
+                if cache is not None:
+                    cache.put(record["text"], vector)
+    return [vectors.get(text) for text in texts]
+
+
+def get_or_create_collection(client, collection_name):
+    """
+    获取集合，不存在时创建。
+    :return: (集合, 是否新建)
+    """
+    collection = client.get(collection_name)
+    if collection:
+        return collection, False
+    # 创建集合：指定集合名称和向量维度, text_embedding_v2 模型产生的向量统一为 1536 维
+    rsp = client.create(collection_name, 1536, fields_schema=CHUNK_FIELDS_SCHEMA)
+    assert rsp
+    return client.get(collection_name), True
+
+
+class IngestCancelled(Exception):
+    """入库任务被取消。"""
+
+
+class IngestIncomplete(Exception):
+    """
+    入库结束但有文本块最终嵌入失败。这些文本块已写入文本块存储但没有记入检查点，重新执行入库即可只补嵌它们。
+    :param dead_letters: 嵌入失败的文本块，每项包含 "text" 和 "error"
+    """
+
+    def __init__(self, message, dead_letters):
+        super().__init__(message)
+        self.dead_letters = dead_letters
+
+
+def ingest_documents(api_key, endpoint_api_key, endpoint, sources, collection_name,
+                     on_progress=None, should_cancel=None):
+    """
+    解析文档并写入向量库，不依赖 Streamlit，可在后台线程中运行。
+    已写入向量库的文本块会记录为检查点，中断后重新执行时直接跳过，从中断处继续。
+    :param sources: (文件路径或文件对象, 文件名) 列表
+    :param collection_name: 集合名称，不存在时自动创建
+    :param on_progress: 进度回调，参数为 (已处理文件数, 文件总数, 已写入文本块数)
+    :param should_cancel: 返回 True 时在当前批次后停止并抛出 IngestCancelled
+    :return: 处理结果说明；有文本块嵌入失败时抛出 IngestIncomplete
+    """
     dashscope.api_key = api_key
 
     # 初始化 dashvector client
@@ -87,42 +397,96 @@ def vectorize_and_store(api_key, endpoint_api_key, endpoint, pdf_folder_path, co
         api_key=endpoint_api_key,
         endpoint=endpoint
     )
+    collection, created = get_or_create_collection(client, collection_name)
 
-    # 创建集合：指定集合名称和向量维度, text_embedding_v2 模型产生的向量统一为 1536 维
-    rsp = client.create(collection_name, 1536)
-    assert rsp
+    # 加载语料：原文写入本地文本块存储，向量库只保存 id 和元数据
+    chunk_store = get_chunk_store()
+    if created:
+        chunk_store.clear_collection(collection_name)
+    embedded_ids = chunk_store.embedded_ids(collection_name)
 
-    # 加载语料
-    id = 0
-    collection = client.get(collection_name)
+    progress = {"files": 0, "chunks": 0}
 
-    data_batches = list(prepare_data(pdf_folder_path))
-    num_batches = len(data_batches)
+    def report_progress():
+        if on_progress:
+            on_progress(progress["files"], len(sources), progress["chunks"])
 
-    progress_bar = st.progress(0)
+    def stream_chunks():
+        for source, name in sources:
+            yield from iter_document_chunks(source, name)
+            progress["files"] += 1
+            report_progress()
 
-    for i, news_batch in enumerate(data_batches):
-        ids = [id + j for j, _ in enumerate(news_batch)]
-        id += len(news_batch)
-
-        vectors = generate_embeddings(news_batch)
-        if vectors is None:
-            print("Skipping batch due to embedding generation error.")
-            continue
-
-        # 写入 dashvector 构建索引
-        rsp = collection.upsert(
-            [
-                Doc(id=str(doc_id), vector=vector, fields={"raw": doc})
-                for doc_id, vector, doc in zip(ids, vectors, news_batch)
-            ]
-        )
-        assert rsp
+    # 嵌入前去重：重复块不再生成向量，只在文本块存储中追加来源引用和条文索引
+    def on_duplicate(chunk_id, record):
+        chunk_store.add_source(collection_name, chunk_id, record["source"])
+        own_id = content_hash(record["text"])
+        if own_id != chunk_id:
+            # 近似重复块复用已有向量，但原文按自己的 id 保存，条文索引指向自己的原文
+            chunk_store.put_many(collection_name, [dict(record, id=own_id)])
+            record = dict(record, id=own_id)
+        chunk_store.put_articles(collection_name, article_index_rows(record))
+
+    deduplicator = ChunkDeduplicator()
+    unique_chunks = deduplicate_chunks(stream_chunks(), deduplicator, on_duplicate=on_duplicate)
 
-        progress = (i + 1) / num_batches
-        progress_bar.progress(progress)
+    def pending_chunks():
+        for record in unique_chunks:
+            if record["id"] in embedded_ids:
+                # 检查点中已写入向量库的文本块不再嵌入，但本次文档的来源和条文索引仍需记录
+                chunk_store.add_source(collection_name, record["id"], record["source"])
+                chunk_store.put_articles(collection_name, article_index_rows(record))
+            else:
+                yield record
 
-    return "All files processed and uploaded successfully."
+    def stream_batches():
+        for news_batch in batch_records(pending_chunks()):
+            if should_cancel and should_cancel():
+                raise IngestCancelled()
+            chunk_store.put_many(collection_name, news_batch)
+            chunk_store.put_articles(collection_name,
+                                     [row for record in news_batch for row in article_index_rows(record)])
+            yield news_batch
+
+    # 按批流式处理：文档逐页读取，批次边生成边嵌入，不在内存中保留整个语料
+    scheduler = EmbeddingScheduler()
+    for batch, vectors in scheduler.map_batches(stream_batches()):
+        docs = [
+            Doc(id=record["id"], vector=vector, fields={**record["metadata"], "chunk_id": record["id"]})
+            for record, vector in zip(batch, vectors)
+            if vector is not None
+        ]
+        # 写入 dashvector 构建索引，成功后记录检查点
+        if docs:
+            rsp = collection.upsert(docs)
+            assert rsp
+            chunk_store.mark_embedded(collection_name, [doc.id for doc in docs])
+            progress["chunks"] += len(docs)
+            report_progress()
+
+    dedup_summary = (f"Deduplicated {deduplicator.duplicates} of {deduplicator.total} chunks "
+                     f"({deduplicator.dedup_ratio:.1%}).")
+    print(dedup_summary)
+
+    if scheduler.dead_letters:
+        raise IngestIncomplete(f"{len(scheduler.dead_letters)} chunks failed to embed, retry to embed them. "
+                               f"{dedup_summary}", scheduler.dead_letters)
+    return f"All files processed and uploaded successfully. {dedup_summary}"
+
+
+def vectorize_and_store(api_key, endpoint_api_key, endpoint, pdf_folder_path, collection_name, uploaded_files=None):
+    """
+    解析文档并写入向量库，在页面上显示进度。传入 uploaded_files 时直接处理上传的文件，追加到已有集合中。
+    :param pdf_folder_path: 资料文件夹路径
+    :param collection_name: 集合名称，不存在时自动创建
+    :param uploaded_files: st.file_uploader 返回的文件列表，可选
+    """
+    progress_bar = st.progress(0)
+    sources = list_sources(pdf_folder_path, uploaded_files)
+    return ingest_documents(
+        api_key, endpoint_api_key, endpoint, sources, collection_name,
+        on_progress=lambda files_done, files_total, _: progress_bar.progress(files_done / files_total)
+    )
 
 
 
@@ -0,0 +1,183 @@
+import io
+import json
+import queue
+import sqlite3
+import threading
+import time
+from chunk_store import CHUNK_STORE_PATH
+from embedding_web import ingest_documents, list_sources, IngestCancelled, IngestIncomplete
+from pdf_topics_web import extract_pdf_topics
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+# 入库结束但有文本块嵌入失败，重试时只补嵌这些文本块
+PARTIAL = "partial"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+FINISHED_STATUSES = (SUCCEEDED, PARTIAL, FAILED, CANCELLED, INTERRUPTED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    status TEXT NOT NULL,
+    files_done INTEGER NOT NULL DEFAULT 0,
+    files_total INTEGER NOT NULL DEFAULT 0,
+    chunks_done INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    topics TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class IngestJobManager:
+    """
+    后台入库任务队列：单个工作线程依次执行任务，任务状态和进度保存在 SQLite 任务表中，
+    页面刷新或脚本重跑都不会中断任务。已写入的批次由 ingest_documents 记录检查点，
+    重试时从中断处继续。
+    :param path: 任务表所在的 SQLite 数据库文件
+    """
+
+    def __init__(self, path=CHUNK_STORE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+            # 上次进程退出时未完成的任务标记为中断，重试即可从检查点继续
+            self._conn.execute(
+                "UPDATE ingest_jobs SET status = ?, message = ? WHERE status IN (?, ?)",
+                (INTERRUPTED, "进程重启，任务已中断，可重试继续", QUEUED, RUNNING)
+            )
+        # API 密钥只保存在内存中，不写入任务表
+        self._credentials = {}
+        # 上传的文件内容同样只保存在内存中，进程重启后需重新上传
+        self._uploads = {}
+        self._cancel_events = {}
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="ingest-worker", daemon=True)
+        self._worker.start()
+
+    def submit(self, dashscope_api_key, dashvector_api_key, dashvector_endpoint, folder, collection_name,
+               sources=None):
+        """
+        提交入库任务。
+        :param folder: 待解析的文件夹，提交上传的文件时可为 None
+        :param sources: 上传的文件对象列表（如 st.file_uploader 返回的 UploadedFile），优先于 folder
+        :return: 任务 id
+        """
+        uploads = None
+        if sources:
+            # 复制一份文件内容，避免与页面重跑时对同一文件对象的读取互相干扰
+            uploads = [_snapshot_upload(source) for source in sources]
+            folder = ""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO ingest_jobs (collection, folder, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (collection_name, folder, QUEUED, now, now)
+            )
+            job_id = cursor.lastrowid
+        if uploads:
+            self._uploads[job_id] = uploads
+        self._enqueue(job_id, (dashscope_api_key, dashvector_api_key, dashvector_endpoint))
+        return job_id
+
+    def retry(self, job_id, dashscope_api_key, dashvector_api_key, dashvector_endpoint):
+        """重新执行部分失败、失败、取消或中断的任务，已写入的批次会被跳过。"""
+        job = self.get(job_id)
+        if job is None or job["status"] not in FINISHED_STATUSES or job["status"] == SUCCEEDED:
+            return False
+        self._update(job_id, status=QUEUED, message=None)
+        self._enqueue(job_id, (dashscope_api_key, dashvector_api_key, dashvector_endpoint))
+        return True
+
+    def cancel(self, job_id):
+        """取消排队中或运行中的任务，运行中的任务在当前批次结束后停止。"""
+        job = self.get(job_id)
+        if job is None or job["status"] not in (QUEUED, RUNNING):
+            return False
+        self._cancel_events.setdefault(job_id, threading.Event()).set()
+        if job["status"] == QUEUED:
+            self._update(job_id, status=CANCELLED)
+        return True
+
+    def get(self, job_id):
+        jobs = self._select("WHERE id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def list_jobs(self, limit=10):
+        return self._select("ORDER BY id DESC LIMIT ?", (limit,))
+
+    def _select(self, clause, params):
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT * FROM ingest_jobs {clause}", params)
+            columns = [column[0] for column in cursor.description]
+            jobs = [dict(zip(columns, row)) for row in cursor]
+        for job in jobs:
+            job["topics"] = json.loads(job["topics"]) if job["topics"] else None
+        return jobs
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE ingest_jobs SET {assignments} WHERE id = ?", list(fields.values()) + [job_id])
+
+    def _enqueue(self, job_id, credentials):
+        self._credentials[job_id] = credentials
+        self._cancel_events[job_id] = threading.Event()
+        self._queue.put(job_id)
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            job = self.get(job_id)
+            cancel_event = self._cancel_events.get(job_id)
+            if job is None or job["status"] != QUEUED or cancel_event.is_set():
+                continue
+            self._execute(job, cancel_event)
+
+    def _execute(self, job, cancel_event):
+        job_id = job["id"]
+        dashscope_api_key, dashvector_api_key, dashvector_endpoint = self._credentials.pop(job_id)
+        uploads = self._uploads.get(job_id)
+        if not job["folder"] and not uploads:
+            self._update(job_id, status=FAILED, message="上传的文件已不在内存中，请重新上传")
+            return
+        sources = list_sources(job["folder"], uploaded_files=uploads)
+        self._update(job_id, status=RUNNING, files_done=0, files_total=len(sources))
+        try:
+            try:
+                status, result = SUCCEEDED, ingest_documents(
+                    dashscope_api_key, dashvector_api_key, dashvector_endpoint, sources, job["collection"],
+                    on_progress=lambda files_done, files_total, chunks_done: self._update(
+                        job_id, files_done=files_done, files_total=files_total,
+                        chunks_done=job["chunks_done"] + chunks_done),
+                    should_cancel=cancel_event.is_set
+                )
+            except IngestIncomplete as e:
+                # 其余文本块已可检索，仍提取主题；失败的文本块留待重试
+                status, result = PARTIAL, str(e)
+            topics = extract_pdf_topics(job["folder"], uploaded_files=uploads)
+            if status == SUCCEEDED:
+                self._uploads.pop(job_id, None)
+            self._update(job_id, status=status, message=result, topics=json.dumps(topics, ensure_ascii=False))
+        except IngestCancelled:
+            self._update(job_id, status=CANCELLED, message="任务已取消，可重试继续")
+        except Exception as e:
+            print(f"Ingest job {job_id} failed: {e}")
+            self._update(job_id, status=FAILED, message=str(e))
+
+
+def _snapshot_upload(uploaded_file):
+    """把上传的文件复制为内存中的文件对象，保留 name 和 type 以便选择解析器。"""
+    snapshot = io.BytesIO(uploaded_file.getvalue())
+    snapshot.name = uploaded_file.name
+    snapshot.type = getattr(uploaded_file, "type", None)
+    return snapshot
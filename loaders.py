@@ -0,0 +1,121 @@
+import io
+import os
+import fitz  # PyMuPDF
+from docx import Document
+
+# 纯文本按段产出时每段的大致字符数
+TEXT_SEGMENT_SIZE = 8192
+
+# 扩展名 -> 加载函数；MIME 类型 -> 扩展名
+LOADERS = {}
+MIME_TYPES = {}
+
+
+def register_loader(extensions, mime_types=()):
+    """
+    注册文档加载函数。加载函数接收文件路径或文件对象，逐段产出 (页码/段号, 文本)。
+    :param extensions: 支持的扩展名列表，例如 [".pdf"]
+    :param mime_types: 对应的 MIME 类型列表，用于没有扩展名的上传文件
+    """
+    def decorator(func):
+        for extension in extensions:
+            LOADERS[extension.lower()] = func
+        for mime_type in mime_types:
+            MIME_TYPES[mime_type] = extensions[0].lower()
+        return func
+    return decorator
+
+
+@register_loader([".pdf"], ["application/pdf"])
+def iter_pdf_pages(source):
+    """使用 PyMuPDF 逐页产出 PDF 文本。"""
+    if isinstance(source, str):
+        doc = fitz.open(source)
+    else:
+        doc = fitz.open(stream=source.read(), filetype="pdf")
+    try:
+        for page_num in range(len(doc)):
+            yield page_num + 1, doc.load_page(page_num).get_text("text")
+    finally:
+        doc.close()
+
+
+@register_loader([".docx"], ["application/vnd.openxmlformats-officedocument.wordprocessingml.document"])
+def iter_docx_paragraphs(source):
+    """逐段产出 DOCX 文本。"""
+    doc = Document(source)
+    for index, para in enumerate(doc.paragraphs, start=1):
+        if para.text.strip():
+            yield index, para.text + "\n"
+
+
+@register_loader([".txt"], ["text/plain"])
+def iter_txt_segments(source):
+    """按行读取纯文本，约每 TEXT_SEGMENT_SIZE 个字符产出一段。"""
+    if isinstance(source, str):
+        stream = open(source, encoding="utf-8", errors="ignore")
+    else:
+        stream = io.TextIOWrapper(source, encoding="utf-8", errors="ignore")
+    try:
+        segment, index = [], 1
+        size = 0
+        for line in stream:
+            segment.append(line)
+            size += len(line)
+            if size >= TEXT_SEGMENT_SIZE:
+                yield index, "".join(segment)
+                segment, size = [], 0
+                index += 1
+        if segment:
+            yield index, "".join(segment)
+    finally:
+        if isinstance(source, str):
+            stream.close()
+        else:
+            # 不关闭调用方传入的文件对象
+            stream.detach()
+
+
+def supported_extensions():
+    """返回支持的扩展名（不含点），可直接用于 st.file_uploader 的 type 参数。"""
+    return [extension.lstrip(".") for extension in LOADERS]
+
+
+def get_loader(name, mime_type=None):
+    extension = os.path.splitext(name or "")[1].lower()
+    if extension in LOADERS:
+        return LOADERS[extension]
+    if mime_type in MIME_TYPES:
+        return LOADERS[MIME_TYPES[mime_type]]
+    return None
+
+
+def is_supported(name, mime_type=None):
+    return get_loader(name, mime_type) is not None
+
+
+def iter_document(source, name=None, mime_type=None):
+    """
+    流式读取文档。
+    :param source: 文件路径或文件对象（如 st.file_uploader 返回的 UploadedFile）
+    :param name: 文件名，默认取路径或文件对象的 name 属性
+    :param mime_type: MIME 类型，默认取文件对象的 type 属性
+    :return: (页码/段号, 文本) 生成器
+    """
+    if name is None:
+        name = source if isinstance(source, str) else getattr(source, "name", "")
+    if mime_type is None:
+        mime_type = getattr(source, "type", None)
+    loader = get_loader(name, mime_type)
+    if loader is None:
+        raise ValueError(f"Unsupported file type: {name}")
+    if not isinstance(source, str) and hasattr(source, "seek"):
+        source.seek(0)
+    yield from loader(source)
+
+
+def list_documents(folder_path):
+    """列出文件夹中所有受支持的文档文件名。"""
+    if not folder_path or not os.path.isdir(folder_path):
+        return []
+    return sorted(file_name for file_name in os.listdir(folder_path) if is_supported(file_name))
@@ -0,0 +1,253 @@
+import time
+import threading
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dashscope import Generation
+
+AUTO_MODEL = "Auto"
+
+# 自动路由的候选模型，按能力分为三档；每档内按实测延迟选择
+MODEL_TIERS = [
+    ["qwen-turbo", "qwen2-7b-instruct"],
+    ["qwen-plus", "qwen1.5-32b-chat"],
+    ["qwen-max", "qwen2-72b-instruct"],
+]
+# 尚无统计数据时各档的预估延迟（秒）
+TIER_PRIOR_LATENCY = [2.0, 5.0, 10.0]
+DEFAULT_LATENCY_BUDGET = 15.0
+# 错误率超过该值的模型暂不参与路由
+MAX_ERROR_RATE = 0.3
+# 延迟和错误率的指数滑动平均系数
+STATS_ALPHA = 0.2
+# 统计的半衰期（秒）：模型一段时间没有被调用时，错误率向 0、延迟向预估值衰减，被排除的模型因此会重新参与路由
+STATS_HALF_LIFE = 60.0
+
+# 需要较强推理能力的任务类型和关键词
+COMPLEX_TASK_TYPES = {"政策解读", "法规咨询", "数据分析", "经济发展", "城市规划", "应急响应"}
+COMPLEX_KEYWORDS = ("分析", "比较", "对比", "为什么", "原因", "影响", "评估", "方案", "建议", "区别")
+
+
+class ModelStats:
+    """
+    按模型统计 Generation.call 的延迟和错误率（指数滑动平均），线程安全。
+    统计随时间衰减：超时或出错的模型不会因为不再被调用而被永久排除。
+    :param half_life: 衰减半衰期（秒）
+    """
+
+    def __init__(self, alpha=STATS_ALPHA, half_life=STATS_HALF_LIFE):
+        self.alpha = alpha
+        self.half_life = half_life
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _decay(self, stats, now):
+        return 0.5 ** (max(0.0, now - stats["updated"]) / self.half_life)
+
+    def record(self, model, latency, ok):
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is None:
+                self._stats[model] = {"latency": latency, "error_rate": 0.0 if ok else 1.0, "calls": 1, "updated": now}
+                return
+            # 距上次记录越久，旧统计的权重越低：错误率先向 0 衰减，延迟则更多地采用本次结果
+            decay = self._decay(stats, now)
+            stats["error_rate"] *= decay
+            stats["latency"] += (1 - (1 - self.alpha) * decay) * (latency - stats["latency"])
+            stats["error_rate"] += self.alpha * ((0.0 if ok else 1.0) - stats["error_rate"])
+            stats["calls"] += 1
+            stats["updated"] = now
+
+    def expected_latency(self, model, default):
+        """:param default: 没有统计数据时的预估延迟，统计随时间向该值衰减"""
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is None:
+                return default
+            return default + (stats["latency"] - default) * self._decay(stats, time.monotonic())
+
+    def error_rate(self, model):
+        with self._lock:
+            stats = self._stats.get(model)
+            return stats["error_rate"] * self._decay(stats, time.monotonic()) if stats else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {model: dict(stats) for model, stats in self._stats.items()}
+
+
+# 进程内共享的模型统计，所有 Generation.call 都经由 timed_generation_call 记录
+model_stats = ModelStats()
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="model-router")
+
+
+def timed_generation_call(model, **kwargs):
+    """调用 Generation.call 并记录该模型的延迟和成败。"""
+    start = time.monotonic()
+    try:
+        rsp = Generation.call(model=model, **kwargs)
+    except Exception:
+        model_stats.record(model, time.monotonic() - start, False)
+        raise
+    model_stats.record(model, time.monotonic() - start, rsp.status_code == HTTPStatus.OK)
+    return rsp
+
+
+def timed_generation_stream(model, **kwargs):
+    """
+    以流式方式调用 Generation.call（stream=True, incremental_output=True），逐个产出增量响应，
+    结束时记录该模型的总延迟和成败。
+    """
+    start = time.monotonic()
+    ok = False
+    try:
+        for rsp in Generation.call(model=model, stream=True, incremental_output=True, **kwargs):
+            ok = rsp.status_code == HTTPStatus.OK
+            yield rsp
+    except Exception:
+        ok = False
+        raise
+    finally:
+        model_stats.record(model, time.monotonic() - start, ok)
+
+
+def estimate_complexity(question, task_type=None):
+    """
+    根据问题长度、任务类型和关键词估计问题难度。
+    :return: 档位序号，0 为简单，2 为复杂
+    """
+    score = 0
+    if len(question) > 200:
+        score += 2
+    elif len(question) > 60:
+        score += 1
+    if task_type in COMPLEX_TASK_TYPES:
+        score += 1
+    score += min(2, sum(keyword in question for keyword in COMPLEX_KEYWORDS))
+    if score == 0:
+        return 0
+    return 1 if score <= 2 else 2
+
+
+class ModelRouter:
+    """
+    “Auto”模型路由：按问题难度选择档位，在延迟预算内选实测最快且健康的模型，超时或出错时改用更快的模型。
+    :param latency_budget: 整次调用（含改用后备模型的重试）的延迟预算（秒）
+    :param stats: 模型统计，默认使用进程内共享的 model_stats
+    """
+
+    def __init__(self, latency_budget=DEFAULT_LATENCY_BUDGET, stats=None):
+        self.latency_budget = latency_budget
+        self.stats = stats or model_stats
+
+    def route(self, question, task_type=None):
+        """
+        :return: 按尝试顺序排列的模型列表，第一个为首选，其余为超时或出错时的后备
+        """
+        desired_tier = estimate_complexity(question, task_type)
+        plan = []
+        for tier in range(desired_tier, -1, -1):
+            ranked = sorted(
+                MODEL_TIERS[tier],
+                key=lambda model: self.stats.expected_latency(model, TIER_PRIOR_LATENCY[tier])
+            )
+            for model in ranked:
+                if self.stats.error_rate(model) > MAX_ERROR_RATE:
+                    continue
+                if self.stats.expected_latency(model, TIER_PRIOR_LATENCY[tier]) > self.latency_budget:
+                    continue
+                plan.append(model)
+                break
+        # 最快档的其余模型作为最后的后备；所有模型都超出预算或不健康时，仍使用最快档的模型
+        plan += [model for model in MODEL_TIERS[0] if model not in plan]
+        return plan
+
+    def call(self, question, task_type=None, **kwargs):
+        """
+        按路由结果调用模型。
+        :return: (实际使用的模型, 响应)
+        """
+        plan = self.route(question, task_type)
+        # 预算覆盖全部尝试：每次尝试只能用剩余的时间，用完后以下一个最快档模型作为最后一次尝试，不再限时
+        deadline = time.monotonic() + self.latency_budget
+        for i, model in enumerate(plan):
+            remaining = deadline - time.monotonic()
+            is_last = i == len(plan) - 1 or (remaining <= 0 and model in MODEL_TIERS[0])
+            if not is_last and remaining <= 0:
+                continue
+            future = _executor.submit(timed_generation_call, model, **kwargs)
+            try:
+                rsp = future.result(timeout=None if is_last else remaining)
+            except TimeoutError:
+                # 超时的调用仍在后台完成并计入统计，后续路由会因此暂时避开该模型
+                print(f"Model {model} exceeded latency budget {self.latency_budget}s, falling back")
+                continue
+            except Exception as e:
+                if is_last:
+                    raise
+                print(f"Model {model} failed: {e}, falling back")
+                continue
+            if rsp.status_code == HTTPStatus.OK or is_last:
+                return model, rsp
+        raise RuntimeError("No model available")
+
+    def stream(self, question, task_type=None, **kwargs):
+        """
+        按路由结果流式调用模型。延迟预算与 call 相同，限制的是收到首个响应的时间：
+        超时或首个响应出错时改用后备模型，已经产出内容后不再切换。
+        :return: 增量响应生成器
+        """
+        plan = self.route(question, task_type)
+        deadline = time.monotonic() + self.latency_budget
+        for i, model in enumerate(plan):
+            remaining = deadline - time.monotonic()
+            is_last = i == len(plan) - 1 or (remaining <= 0 and model in MODEL_TIERS[0])
+            if not is_last and remaining <= 0:
+                continue
+            responses = timed_generation_stream(model, **kwargs)
+            future = _executor.submit(next, responses, None)
+            try:
+                first = future.result(timeout=None if is_last else remaining)
+            except TimeoutError:
+                # 超时的流在后台收到首个响应后关闭，关闭时计入统计，后续路由会因此暂时避开该模型
+                future.add_done_callback(lambda _, responses=responses: responses.close())
+                print(f"Model {model} exceeded latency budget {self.latency_budget}s, falling back")
+                continue
+            except Exception as e:
+                if is_last:
+                    raise
+                print(f"Model {model} failed: {e}, falling back")
+                continue
+            if first is None and is_last:
+                return
+            if first is not None and (first.status_code == HTTPStatus.OK or is_last):
+                yield first
+                yield from responses
+                return
+            responses.close()
+            error = f"error code: {first.code}, error message: {first.message}" if first is not None else "no output"
+            print(f"Model {model} failed: {error}, falling back")
+        raise RuntimeError("No model available")
+
+
+def generate(model, question="", task_type=None, latency_budget=DEFAULT_LATENCY_BUDGET, **kwargs):
+    """
+    统一的生成入口：model 为 "Auto" 时自动路由，否则直接调用指定模型。
+    :param question: 用于判断难度的用户问题（仅自动路由时使用）
+    :param kwargs: 传给 Generation.call 的其余参数
+    :return: Generation.call 的响应
+    """
+    if model != AUTO_MODEL:
+        return timed_generation_call(model, **kwargs)
+    _, rsp = ModelRouter(latency_budget).call(question, task_type, **kwargs)
+    return rsp
+
+
+def generate_stream(model, question="", task_type=None, latency_budget=DEFAULT_LATENCY_BUDGET, **kwargs):
+    """
+    流式生成入口，参数同 generate。
+    :return: Generation.call 增量响应的生成器，每个响应只包含新生成的文本
+    """
+    if model != AUTO_MODEL:
+        return timed_generation_stream(model, **kwargs)
+    return ModelRouter(latency_budget).stream(question, task_type, **kwargs)
@@ -7,32 +7,38 @@ from nltk.tokenize import word_tokenize, sent_tokenize
 from collections import Counter
 import networkx as nx
 import matplotlib.pyplot as plt
-import docx
 import pandas as pd
-from io import StringIO
-from pdfminer.high_level import extract_text_to_fp
-from pdfminer.layout import LAParams
-from docx import Document
 import json
 from transformers import AutoTokenizer, BertTokenizer
 import jieba
-import re
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from loaders import iter_document, list_documents, supported_extensions
+from text_structure import iter_structure, iter_structured_chunks
+from text_analysis import StreamingTextAnalyzer
+
+# 超过该大小的上传文件默认使用逐页流式分析
+STREAMING_THRESHOLD_BYTES = 20 * 1024 * 1024
 
 # 使用中文BERT分词器
 tokenizer = BertTokenizer.from_pretrained("bert-base-chinese")
 
-def extract_pdf_topics(pdf_folder_path, num_topics=12):
+def extract_document_topics(source, name=None, num_topics=12):
+    """逐页统计词频，提取单个文档的主题词。source 可以是文件路径或上传的文件对象。"""
+    word_counts = Counter()
+    for _, page_text in iter_document(source, name):
+        word_counts.update(jieba.lcut(page_text))
+    common_words = word_counts.most_common(num_topics)
+    return [word for word, _ in common_words if len(word) > 1]  # 过滤掉单字词
+
+def extract_pdf_topics(pdf_folder_path, num_topics=12, uploaded_files=None):
     pdf_topics = {}
-    for file_name in os.listdir(pdf_folder_path):
-        if file_name.lower().endswith(".pdf"):
-            pdf_path = os.path.join(pdf_folder_path, file_name)
-            text = load_pdf(open(pdf_path, 'rb'))
-            words = jieba.lcut(text)
-            word_counts = Counter(words)
-            common_words = word_counts.most_common(num_topics)
-            topics = [word for word, _ in common_words if len(word) > 1]  # 过滤掉单字词
-            pdf_topics[file_name] = topics
+    if uploaded_files:
+        for uploaded_file in uploaded_files:
+            pdf_topics[uploaded_file.name] = extract_document_topics(uploaded_file, num_topics=num_topics)
+        return pdf_topics
+    for file_name in list_documents(pdf_folder_path):
+        pdf_path = os.path.join(pdf_folder_path, file_name)
+        pdf_topics[file_name] = extract_document_topics(pdf_path, file_name, num_topics)
     return pdf_topics
 
 def draw_knowledge_graph(topics, title):
@@ -48,98 +54,67 @@ def draw_knowledge_graph(topics, title):
     st.pyplot(plt)
 
 def load_document(file):
-    if file.type == "application/pdf":
-        return load_pdf(file)
-    elif file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        return load_docx(file)
-    elif file.type == "text/plain":
-        return load_txt(file)
-    else:
+    try:
+        return "".join(text for _, text in iter_document(file))
+    except ValueError:
         st.error("Unsupported file type")
         return None
 
-def load_pdf(file):
-    output_string = StringIO()
-    extract_text_to_fp(file, output_string, laparams=LAParams(), output_type='text', codec='utf-8')
-    return output_string.getvalue()
-
-def load_docx(file):
-    doc = Document(file)
-    return "\n".join([para.text for para in doc.paragraphs])
-
-def load_txt(file):
-    return file.getvalue().decode("utf-8")
-
 def split_text_by_structure(text, chunk_size=1000, chunk_overlap=200):
-    # 使用正则表达式匹配中文法律文档的常见结构
-    pattern = r'(第[一二三四五六七八九十百千]+[章节条]|\d+\.)'
-    splits = re.split(pattern, text)
-    
-    # 重新组合分割后的文本，确保每个chunk都以结构标记开头
-    chunks = []
-    current_chunk = ""
-    for i in range(0, len(splits), 2):
-        if i+1 < len(splits):
-            section = splits[i] + splits[i+1]
-        else:
-            section = splits[i]
-        
-        if len(current_chunk) + len(section) > chunk_size:
-            chunks.append(current_chunk)
-            current_chunk = section
-        else:
-            current_chunk += section
-    
-    if current_chunk:
-        chunks.append(current_chunk)
-    
-    return chunks
+    # 按中文法律文档的结构（章、节、条）分块，每个结构段落都以结构标记开头
+    return [chunk["text"] for chunk in iter_structured_chunks([(1, text)], chunk_size)]
 
 def extract_structure(text):
-    lines = text.split('\n')
-    structure = []
-    current_level = 0
-    for line in lines:
-        if line.strip():
-            # 匹配中文法律文档的常见结构
-            if re.match(r'第[一二三四五六七八九十百千]+章', line):
-                level = 1
-            elif re.match(r'第[一二三四五六七八九十百千]+节', line):
-                level = 2
-            elif re.match(r'第[一二三四五六七八九十百千]+条', line):
-                level = 3
-            else:
-                level = current_level
-            
-            content = line.strip()
-            structure.append({"level": level, "content": content})
-            current_level = level
-    return structure
+    # 匹配中文法律文档的常见结构
+    return list(iter_structure(text.split('\n')))
 
-def visualize_text_processing(original_text, chunks, structure):
+def render_text_statistics(preview_text, chunk_lengths, word_freq, structure, total_chars=None):
     st.subheader("文本处理可视化")
     
     # 显示原始文本
     st.write("原始文本")
-    st.text_area("", value=original_text[:1000] + "..." if len(original_text) > 1000 else original_text, height=200, disabled=True)
+    total_chars = len(preview_text) if total_chars is None else total_chars
+    st.text_area("", value=preview_text[:1000] + "..." if total_chars > 1000 else preview_text, height=200, disabled=True)
     
     # 显示文本分割结果
     st.write("文本分割结果")
-    chunk_lengths = [len(chunk) for chunk in chunks]
-    df = pd.DataFrame({"Chunk": range(1, len(chunks) + 1), "Character Count": chunk_lengths})
+    df = pd.DataFrame({"Chunk": range(1, len(chunk_lengths) + 1), "Character Count": chunk_lengths})
     st.bar_chart(df.set_index("Chunk"))
     
     # 显示词频统计
     st.write("词频统计")
-    words = jieba.lcut(original_text)
-    word_freq = pd.Series(words).value_counts().head(20)
     st.bar_chart(word_freq)
     
     # 显示文档结构
     st.write("文档结构")
     st.json(json.dumps(structure, indent=2, ensure_ascii=False))
 
-def process_document(file):
+def visualize_text_processing(original_text, chunks, structure):
+    chunk_lengths = [len(chunk) for chunk in chunks]
+    words = jieba.lcut(original_text)
+    word_freq = pd.Series(words).value_counts().head(20)
+    render_text_statistics(original_text, chunk_lengths, word_freq, structure)
+
+def process_document(file, streaming=None):
+    """
+    解析并可视化上传的文档。
+    :param streaming: 是否逐页流式分析；默认在文件超过 STREAMING_THRESHOLD_BYTES 时启用。
+                      流式模式下返回的是原文预览、前若干个文本块和章/节/条标题
+    """
+    if streaming is None:
+        streaming = getattr(file, "size", 0) > STREAMING_THRESHOLD_BYTES
+    if streaming:
+        try:
+            analyzer = StreamingTextAnalyzer().run(iter_document(file))
+        except ValueError:
+            st.error("Unsupported file type")
+            return None, None, None
+        render_text_statistics(analyzer.preview, analyzer.chunk_lengths, pd.Series(dict(analyzer.top_words())),
+                               analyzer.structure, analyzer.total_chars)
+        if analyzer.skipped_headings:
+            st.caption(f"另有 {analyzer.skipped_headings} 个标题未显示")
+        return analyzer.preview, analyzer.preview_chunks, analyzer.structure
+
     text = load_document(file)
     if text:
         chunks = split_text_by_structure(text)
@@ -152,7 +127,7 @@ def process_document(file):
 def main():
     st.title("法律文档处理和可视化系统")
     
-    uploaded_file = st.file_uploader("选择一个文件", type=["pdf", "docx", "txt"])
+    uploaded_file = st.file_uploader("选择一个文件", type=supported_extensions())
     if uploaded_file is not None:
         text, chunks, structure = process_document(uploaded_file)
         if text:
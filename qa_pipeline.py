@@ -0,0 +1,89 @@
+from http import HTTPStatus
+from article_index import lookup_article
+from model_router import generate, generate_stream
+from search_web import search_many_news, infer_filters
+
+
+def retrieve_contexts(questions, queries, endpoint_api_key, endpoint_api_secret, collection_name, query_vectors=None,
+                      embedding_cache=None):
+    """
+    批量检索回答问题所需的上下文：“第X条”类问题直接查条文索引，其余问题合并为一次批量向量检索。
+    :param questions: 完整提示（含任务模板）列表，用于向量检索
+    :param queries: 用户的原始问题列表，用于推断过滤条件和匹配条文引用
+    :param query_vectors: 与 questions 对齐的预先计算好的向量，可选
+    :param embedding_cache: 问题向量缓存，可选
+    :return: 与 questions 对齐的上下文列表
+    """
+    contexts = [None] * len(questions)
+    pending = []
+    for i, (question, query) in enumerate(zip(questions, queries)):
+        # 根据用户的原始问题推断文件、年份、章等过滤条件，在向量库中缩小检索范围
+        filters = infer_filters(query or question, collection_name)
+        # “第X条”类问题直接查条文索引，不调用嵌入接口和向量检索
+        contexts[i] = lookup_article(query or question, collection_name, sources=filters.get("source"))
+        if contexts[i] is None:
+            pending.append((i, filters))
+    if pending:
+        found = search_many_news(
+            [questions[i] for i, _ in pending], endpoint_api_key, endpoint_api_secret, collection_name,
+            filters=[filters for _, filters in pending],
+            query_vectors=[query_vectors[i] for i, _ in pending] if query_vectors else None,
+            embedding_cache=embedding_cache
+        )
+        for (i, _), context in zip(pending, found):
+            contexts[i] = context
+    return contexts
+
+
+def retrieve_context(question, query, endpoint_api_key, endpoint_api_secret, collection_name, query_vector=None):
+    """
+    检索回答问题所需的上下文。
+    :param question: 完整提示（含任务模板），用于向量检索
+    :param query: 用户的原始问题，用于推断过滤条件和匹配条文引用
+    :param query_vector: 预先计算好的 question 向量，可选
+    :return: 上下文文本
+    """
+    return retrieve_contexts([question], [query], endpoint_api_key, endpoint_api_secret, collection_name,
+                             query_vectors=[query_vector])[0]
+
+
+def build_answer_prompt(question, context):
+    """组装基于上下文回答问题的提示。"""
+    return f'''请基于```内的内容回答问题。"
+    ```
+    {context}
+    ```
+    我的问题是：{question}。
+    '''
+
+
+def answer_question(question, context, model, routing=None, on_error=print):
+    """
+    基于上下文回答问题。
+    :param routing: 传给 generate 的自动路由参数（question、task_type、latency_budget），可选
+    :param on_error: 接口返回错误时调用，参数为错误信息
+    :return: 回答文本，出错时返回 "Error"
+    """
+    rsp = generate(model, prompt=build_answer_prompt(question, context), **(routing or {}))
+    if rsp.status_code == HTTPStatus.OK:
+        return rsp.output.text.strip()
+    else:
+        on_error(f"Request id: {rsp.request_id}, Status code: {rsp.status_code}, "
+                 f"error code: {rsp.code}, error message: {rsp.message}")
+        return "Error"
+
+
+def stream_answer(question, context, model, routing=None, on_error=print):
+    """
+    基于上下文流式回答问题，边生成边产出新增的文本。
+    :param routing: 传给 generate_stream 的自动路由参数（question、task_type、latency_budget），可选
+    :param on_error: 接口返回错误时调用，参数为错误信息；出错后不再产出
+    :return: 回答文本增量的生成器
+    """
+    for rsp in generate_stream(model, prompt=build_answer_prompt(question, context), **(routing or {})):
+        if rsp.status_code != HTTPStatus.OK:
+            on_error(f"Request id: {rsp.request_id}, Status code: {rsp.status_code}, "
+                     f"error code: {rsp.code}, error message: {rsp.message}")
+            return
+        if rsp.output.text:
+            yield rsp.output.text
@@ -0,0 +1,376 @@
+import re
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dashvector import Client
+from chunk_store import get_chunk_store
+from embedding_web import embed_queries
+
+NORMALIZATIONS = ("none", "minmax", "zscore", "rank")
+# BM25Okapi 参数，与 rank_bm25 的默认值一致
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+# 与 sklearn TfidfVectorizer 默认分词规则一致：至少两个字符的单词
+TFIDF_TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+# 批量检索时同时在途的向量库查询数
+QUERY_MAX_WORKERS = 4
+# 按文件过滤时最多按 id 放行的共享文本块数，超过后改为扩大检索范围（topk 的倍数）再按来源和 id 过滤
+SOURCE_FILTER_MAX_IDS = 200
+SOURCE_FILTER_OVERSAMPLE = 5
+
+
+def _count_matrix(token_lists):
+    """
+    把分词结果转换为词频矩阵。
+    :return: (文档数 x 词表大小) 的词频矩阵
+    """
+    vocabulary = {}
+    rows, columns = [], []
+    for row, tokens in enumerate(token_lists):
+        for token in tokens:
+            rows.append(row)
+            columns.append(vocabulary.setdefault(token, len(vocabulary)))
+    counts = np.zeros((len(token_lists), len(vocabulary)))
+    np.add.at(counts, (rows, columns), 1)
+    return counts
+
+
+def calculate_tfidf_similarities(question, candidate_news):
+    """
+    计算问题和候选新闻的TF-IDF余弦相似度，在候选和问题组成的语料上计算 IDF（平滑 IDF、L2 归一化）。
+    :param question: 问题文本
+    :param candidate_news: 候选新闻文本列表
+    :return: 相似度数组
+    """
+    counts = _count_matrix([TFIDF_TOKEN_PATTERN.findall(text.lower()) for text in list(candidate_news) + [question]])
+    document_frequency = (counts > 0).sum(axis=0)
+    idf = np.log((1 + len(counts)) / (1 + document_frequency)) + 1
+    tfidf = counts * idf
+    norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+    tfidf /= np.where(norms > 0, norms, 1)
+    return tfidf[:-1] @ tfidf[-1]
+
+
+def calculate_bm25_scores(question, candidate_news, k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON):
+    """
+    计算BM25（Okapi）评分，按空格分词；IDF 为负的词改用平均 IDF 的 epsilon 倍。
+    :param question: 问题文本
+    :param candidate_news: 候选新闻文本列表
+    :return: BM25评分数组
+    """
+    if not candidate_news:
+        return np.zeros(0)
+    token_lists = [doc.split(" ") for doc in candidate_news] + [question.split(" ")]
+    counts = _count_matrix(token_lists)
+    term_frequency, query_counts = counts[:-1], counts[-1]
+    # 只在问题中出现、候选中没有的词不参与 IDF 计算
+    in_corpus = term_frequency.sum(axis=0) > 0
+    term_frequency, query_counts = term_frequency[:, in_corpus], query_counts[in_corpus]
+
+    corpus_size = len(candidate_news)
+    document_frequency = (term_frequency > 0).sum(axis=0)
+    idf = np.log(corpus_size - document_frequency + 0.5) - np.log(document_frequency + 0.5)
+    idf[idf < 0] = epsilon * idf.mean()
+
+    doc_lengths = np.array([len(tokens) for tokens in token_lists[:-1]], dtype=float)
+    length_norm = k1 * (1 - b + b * doc_lengths / doc_lengths.mean())
+    saturated = term_frequency * (k1 + 1) / (term_frequency + length_norm[:, None])
+    return saturated @ (idf * query_counts)
+
+
+def cosine_similarities(query_vector, candidate_vectors):
+    """计算一个向量与一组向量的余弦相似度。"""
+    candidate_vectors = np.asarray(candidate_vectors, dtype=float)
+    query_vector = np.asarray(query_vector, dtype=float)
+    norms = np.linalg.norm(candidate_vectors, axis=1) * np.linalg.norm(query_vector)
+    return (candidate_vectors @ query_vector) / np.where(norms > 0, norms, 1)
+
+
+def normalize_scores(scores, method="none"):
+    """
+    归一化一路打分，使不同量纲的分数可以加权相加。
+    :param method: none 不处理；minmax 缩放到 [0, 1]；zscore 标准化；rank 按名次映射到 (0, 1]，第一名为 1
+    :return: 归一化后的数组
+    """
+    scores = np.asarray(scores, dtype=float)
+    if method == "none" or scores.size == 0:
+        return scores
+    if method == "minmax":
+        span = scores.max() - scores.min()
+        return (scores - scores.min()) / span if span > 0 else np.ones_like(scores)
+    if method == "zscore":
+        std = scores.std()
+        return (scores - scores.mean()) / std if std > 0 else np.zeros_like(scores)
+    if method == "rank":
+        ranks = np.empty(scores.size)
+        ranks[np.argsort(-scores, kind="stable")] = np.arange(scores.size)
+        return 1.0 - ranks / scores.size
+    raise ValueError(f"Unknown normalization: {method}")
+
+
+def fuse_scores(scores, weights, normalization="none"):
+    """
+    加权融合多路打分。
+    :param scores: 打分名称（如 "vector"、"tfidf"、"bm25"）到分数数组的字典
+    :param weights: 各路打分的权重，缺少的按 0 处理
+    :param normalization: 加权前对每路打分使用的归一化方法，见 normalize_scores
+    :return: 融合后的分数数组
+    """
+    combined = np.zeros(len(next(iter(scores.values()))))
+    for name, values in scores.items():
+        weight = weights.get(name, 0.0)
+        if weight:
+            combined += weight * normalize_scores(values, normalization)
+    return combined
+
+
+def build_filter_expression(filters, shared_ids=()):
+    """
+    把过滤条件转换为 dashvector 的过滤表达式。
+    :param filters: {字段名: 值}，值为列表时表示取其一
+    :param shared_ids: 按文件过滤时额外放行的文本块 id（见 ChunkStore.shared_chunk_ids）
+    :return: 过滤表达式，没有条件时返回 None
+    """
+    def literal(value):
+        if isinstance(value, str):
+            return "'" + value.replace("'", "''") + "'"
+        return str(value)
+
+    clauses = []
+    for field, value in (filters or {}).items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        options = [f"{field} = {literal(v)}" for v in values]
+        if field == "source":
+            # 向量上的 source 只记了首个来源，被去重合并的共享文本块按 id 放行
+            options += [f"chunk_id = {literal(chunk_id)}" for chunk_id in shared_ids]
+        clauses.append(options[0] if len(options) == 1 else "(" + " or ".join(options) + ")")
+    return " and ".join(clauses) or None
+
+
+@functools.lru_cache(maxsize=16)
+def get_collection(api_key, endpoint_key, collection_name):
+    """获取集合句柄，同一集合只建立一次连接，供多次检索复用。"""
+    client = Client(
+        api_key=api_key,
+        endpoint=endpoint_key
+    )
+    collection = client.get(collection_name)
+    assert collection
+    return collection
+
+
+def query_candidates(collection, query_vector, topk, filters=None, output_fields=('source',), shared_ids=()):
+    """
+    向量检索候选。
+    :param filters: 元数据过滤条件，过滤后没有结果时退回全库检索
+    :param output_fields: 随结果返回的字段
+    :param shared_ids: 按文件过滤时额外放行的共享文本块 id，数量过多时改为扩大检索范围后按来源和 id 过滤
+    :return: 检索结果列表
+    """
+    rsp = None
+    if filters and filters.get("source") and len(shared_ids) > SOURCE_FILTER_MAX_IDS:
+        sources = filters["source"] if isinstance(filters["source"], (list, tuple, set)) else [filters["source"]]
+        allowed_sources, allowed_ids = set(sources), set(shared_ids)
+        other_filters = {field: value for field, value in filters.items() if field != "source"}
+        rsp = collection.query(query_vector, filter=build_filter_expression(other_filters),
+                               output_fields=list(set(output_fields) | {'source'}),
+                               topk=topk * SOURCE_FILTER_OVERSAMPLE)
+        if rsp and rsp.output:
+            matched = [item for item in rsp.output
+                       if item.fields.get('source') in allowed_sources or item.id in allowed_ids][:topk]
+            if matched:
+                return matched
+        rsp = None
+    else:
+        filter_expression = build_filter_expression(filters, shared_ids)
+        if filter_expression:
+            rsp = collection.query(query_vector, filter=filter_expression, output_fields=list(output_fields),
+                                   topk=topk)
+    if not rsp or not rsp.output:
+        rsp = collection.query(query_vector, output_fields=list(output_fields), topk=topk)
+    assert rsp
+    return rsp.output
+
+
+def lookup_chunk_texts(collection, collection_name, chunk_ids):
+    """
+    按 id 批量取回文本块原文：优先读本地文本块存储，缺失的再从向量库的 raw 字段补齐（兼容旧集合）。
+    :param collection: dashvector 集合
+    :param collection_name: 集合名称
+    :param chunk_ids: 块 id 列表
+    :return: 与 chunk_ids 对齐的文本列表
+    """
+    texts = get_chunk_store().get_texts(collection_name, chunk_ids)
+    missing = [chunk_id for chunk_id, text in zip(chunk_ids, texts) if text is None]
+    if missing:
+        rsp = collection.fetch(missing)
+        fetched = {doc_id: doc.fields.get('raw', '') for doc_id, doc in rsp.output.items()} if rsp else {}
+        texts = [fetched.get(chunk_id, '') if text is None else text for chunk_id, text in zip(chunk_ids, texts)]
+    return texts
+
+
+class CandidateSet:
+    """
+    一个问题的候选集合，检索各阶段在此基础上追加打分。
+    :param question: 问题文本
+    :param ids: 候选文本块 id 列表
+    :param texts: 候选原文列表
+    :param vector_scores: 向量库返回的相似度分数
+    """
+
+    def __init__(self, question, ids, texts, vector_scores):
+        self.question = question
+        self.ids = ids
+        self.texts = texts
+        # 稀疏打分使用的问题和候选文本，翻译等阶段可以改写
+        self.query_text = question
+        self.scoring_texts = texts
+        self.scores = {"vector": np.asarray(vector_scores, dtype=float)}
+
+    def ranked(self, weights, normalization="none", top_n=None):
+        """
+        按融合分数排序。
+        :return: {"id", "text", "score"} 列表，分数从高到低
+        """
+        if not self.ids:
+            return []
+        combined = fuse_scores(self.scores, weights, normalization)
+        order = np.argsort(-combined, kind="stable")[:top_n]
+        return [{"id": self.ids[i], "text": self.texts[i], "score": float(combined[i])} for i in order]
+
+
+class DashVectorCandidates:
+    """
+    候选生成阶段：批量生成问题向量后在 DashVector 中检索候选，原文统一从本地文本块存储取回。
+    :param text_field: 直接从该字段读取原文（如旧集合的 "raw"），为空时查本地文本块存储
+    :param embedding_cache: 问题向量缓存（QueryEmbeddingCache），可选
+    """
+
+    def __init__(self, api_key, endpoint_key, collection_name, text_field=None, embedding_cache=None,
+                 max_workers=QUERY_MAX_WORKERS):
+        self.api_key = api_key
+        self.endpoint_key = endpoint_key
+        self.collection_name = collection_name
+        self.text_field = text_field
+        self.embedding_cache = embedding_cache
+        self.max_workers = max_workers
+
+    def generate(self, questions, topk, filters=None, query_vectors=None):
+        """
+        :param filters: 与 questions 对齐的过滤条件列表，可选
+        :param query_vectors: 与 questions 对齐的预先计算好的问题向量，缺少的批量生成
+        :return: 与 questions 对齐的 CandidateSet 列表，生成向量失败的问题没有候选
+        """
+        filters = filters or [None] * len(questions)
+        query_vectors = list(query_vectors or [None] * len(questions))
+        missing = [i for i, vector in enumerate(query_vectors) if vector is None]
+        if missing:
+            vectors = embed_queries([questions[i] for i in missing], self.embedding_cache)
+            for i, vector in zip(missing, vectors):
+                query_vectors[i] = vector
+
+        collection = get_collection(self.api_key, self.endpoint_key, self.collection_name)
+        output_fields = (self.text_field,) if self.text_field else ('source',)
+
+        chunk_store = get_chunk_store()
+
+        def query(args):
+            vector, query_filters = args
+            if vector is None:
+                return []
+            shared_ids = ()
+            if query_filters and query_filters.get("source"):
+                shared_ids = chunk_store.shared_chunk_ids(self.collection_name, query_filters["source"])
+            return query_candidates(collection, vector, topk, query_filters, output_fields, shared_ids)
+
+        if len(questions) > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(query, zip(query_vectors, filters)))
+        else:
+            results = [query(args) for args in zip(query_vectors, filters)]
+
+        if self.text_field:
+            texts = {item.id: item.fields.get(self.text_field, '') for output in results for item in output}
+        else:
+            # 所有问题的候选合并为一次文本块存储查询
+            ids = list(dict.fromkeys(item.id for output in results for item in output))
+            texts = dict(zip(ids, lookup_chunk_texts(collection, self.collection_name, ids)))
+        # 取不到原文的候选（文本块存储丢失或未挂载，且向量上没有 raw 字段）不参与排序，避免以空文本作为上下文
+        missing = {chunk_id for chunk_id, text in texts.items() if not text}
+        if missing:
+            print(f"Dropped {len(missing)} candidate(s) without text in collection {self.collection_name}; "
+                  f"check that the chunk store ({get_chunk_store().path}) is the one used at ingest time")
+            results = [[item for item in output if item.id not in missing] for output in results]
+        return [
+            CandidateSet(question, [item.id for item in output], [texts[item.id] for item in output],
+                         [item.score for item in output])
+            for question, output in zip(questions, results)
+        ]
+
+
+class ScoringStage:
+    """
+    打分阶段：对每个候选集合计算一路打分。
+    :param name: 打分名称，对应融合权重中的键
+    :param score_fn: (问题文本, 候选文本列表) -> 分数数组
+    """
+
+    def __init__(self, name, score_fn):
+        self.name = name
+        self.score_fn = score_fn
+
+    def apply(self, candidate_sets):
+        for candidate_set in candidate_sets:
+            if candidate_set.ids:
+                candidate_set.scores[self.name] = np.asarray(
+                    self.score_fn(candidate_set.query_text, candidate_set.scoring_texts), dtype=float)
+
+
+def tfidf_stage():
+    return ScoringStage("tfidf", calculate_tfidf_similarities)
+
+
+def bm25_stage(k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON):
+    return ScoringStage("bm25", functools.partial(calculate_bm25_scores, k1=k1, b=b, epsilon=epsilon))
+
+
+class RetrievalEngine:
+    """
+    检索引擎：候选生成 -> 各打分/重排阶段 -> 加权融合排序。
+    各阶段都以一批问题为单位执行，批量调用时嵌入、向量检索和文本读取的开销在问题之间分摊。
+    :param generator: 候选生成阶段，提供 generate(questions, topk, filters, query_vectors)
+    :param stages: 依次执行的阶段，提供 apply(candidate_sets)
+    :param weights: 融合权重，键为打分名称
+    :param normalization: 融合前的归一化方法，见 normalize_scores
+    :param topk: 每个问题的候选数量
+    """
+
+    def __init__(self, generator, stages=(), weights=None, normalization="none", topk=3):
+        self.generator = generator
+        self.stages = list(stages)
+        self.weights = weights or {"vector": 1.0}
+        self.normalization = normalization
+        self.topk = topk
+
+    def collect(self, questions, topk=None, filters=None, query_vectors=None):
+        """
+        生成候选并执行全部打分阶段，不做融合。
+        :return: 与 questions 对齐的 CandidateSet 列表
+        """
+        candidate_sets = self.generator.generate(questions, topk or self.topk, filters, query_vectors)
+        for stage in self.stages:
+            stage.apply(candidate_sets)
+        return candidate_sets
+
+    def search_many(self, questions, top_n=1, topk=None, filters=None, query_vectors=None):
+        """
+        批量检索。
+        :param top_n: 每个问题返回的结果数，None 表示返回全部候选
+        :return: 与 questions 对齐的结果列表，每项为 {"id", "text", "score"} 列表
+        """
+        return [candidate_set.ranked(self.weights, self.normalization, top_n)
+                for candidate_set in self.collect(questions, topk, filters, query_vectors)]
+
+    def search(self, question, top_n=1, topk=None, filters=None, query_vector=None):
+        return self.search_many([question], top_n, topk, [filters], [query_vector])[0]
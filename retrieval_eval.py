@@ -0,0 +1,218 @@
+"""
+检索评测：在标注好的“问题 -> 相关文本块”数据上扫描候选数量、归一化方法和融合权重，
+报告 recall@k、MRR 和单次检索延迟，并把最优配置写成 search_relevant_news 可直接读取的检索配置文件。
+
+    python retrieval_eval.py labelled.jsonl --collection my_collection --topk 3 5 10 20
+
+标注文件每行包含 question 和 relevant_ids（相关文本块 id 列表），可选 task_type。
+API 密钥默认读取环境变量 DASHSCOPE_API_KEY、DASHVECTOR_API_KEY 和 DASHVECTOR_ENDPOINT。
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+import dashscope
+from embedding_web import embed_queries
+from prompts import GovernmentAgentPrompts
+from retrieval_core import NORMALIZATIONS, fuse_scores
+from search_web import DEFAULT_RETRIEVAL_CONFIG, RETRIEVAL_CONFIG_PATH, build_engine, infer_filters
+
+DEFAULT_TOPKS = (3, 5, 10, 20)
+DEFAULT_RECALL_KS = (1, 3, 5)
+DEFAULT_WEIGHT_STEP = 0.1
+SCORE_NAMES = ("vector", "tfidf", "bm25")
+
+
+def load_labelled(path):
+    """
+    读取标注数据。
+    :return: {"question", "relevant_ids", "task_type"} 列表
+    """
+    items = []
+    with open(path, encoding="utf-8-sig") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            relevant_ids = [str(chunk_id) for chunk_id in row.get("relevant_ids") or ()]
+            if not row.get("question") or not relevant_ids:
+                print(f"Skipping line {line_no}: needs question and relevant_ids")
+                continue
+            items.append({"question": row["question"], "relevant_ids": set(relevant_ids),
+                          "task_type": row.get("task_type")})
+    return items
+
+
+def weight_grid(step=DEFAULT_WEIGHT_STEP):
+    """
+    生成和为 1 的 (vector, tfidf, bm25) 权重组合，另加当前默认权重作为对照。
+    :param step: 权重步长
+    :return: 权重字典列表
+    """
+    n = int(round(1 / step))
+    grid = [dict(zip(SCORE_NAMES, (round(i * step, 4), round(j * step, 4), round((n - i - j) * step, 4))))
+            for i in range(n + 1) for j in range(n + 1 - i)]
+    default_weights = DEFAULT_RETRIEVAL_CONFIG["weights"]
+    if default_weights not in grid:
+        grid.append(dict(default_weights))
+    return grid
+
+
+def collect_candidates(items, engine, collection_name, topks, default_task_type):
+    """
+    对每个问题、每个候选数量执行一次检索并计算各路原始打分，供后续离线扫描归一化方法和权重。
+    问题向量预先批量生成，每个问题单独检索以测得单次检索延迟。
+    :param engine: 检索引擎（见 search_web.build_engine），只使用其候选生成和打分阶段
+    :return: {topk: [{"ids", "scores", "retrieval_ms"}, ...]}，列表与 items 对齐
+    """
+    prompts = [GovernmentAgentPrompts.generate_response(item["task_type"] or default_task_type, item["question"])
+               for item in items]
+    vectors = embed_queries(prompts)
+    runs = {topk: [] for topk in topks}
+    for item, prompt, vector in zip(items, prompts, vectors):
+        filters = infer_filters(item["question"], collection_name)
+        for topk in topks:
+            if vector is None:
+                runs[topk].append(None)
+                continue
+            start = time.monotonic()
+            candidate_set = engine.collect([prompt], topk, [filters], [vector])[0]
+            runs[topk].append({"ids": candidate_set.ids, "scores": candidate_set.scores,
+                               "retrieval_ms": (time.monotonic() - start) * 1000})
+    return runs
+
+
+def evaluate_config(items, runs, weights, normalization, recall_ks):
+    """
+    在已收集的候选上评估一组归一化方法和权重。
+    :return: 指标字典（recall@k、mrr 和延迟统计）
+    """
+    recalls = {k: [] for k in recall_ks}
+    reciprocal_ranks, latencies = [], []
+    for item, run in zip(items, runs):
+        if run is None:
+            # 嵌入失败的问题记为未命中
+            reciprocal_ranks.append(0.0)
+            for k in recall_ks:
+                recalls[k].append(0.0)
+            continue
+        start = time.monotonic()
+        order = np.argsort(-fuse_scores(run["scores"], weights, normalization), kind="stable")
+        latencies.append(run["retrieval_ms"] + (time.monotonic() - start) * 1000)
+        ranked = [run["ids"][i] for i in order]
+        hits = [rank for rank, chunk_id in enumerate(ranked) if chunk_id in item["relevant_ids"]]
+        reciprocal_ranks.append(1.0 / (hits[0] + 1) if hits else 0.0)
+        for k in recall_ks:
+            recalls[k].append(sum(rank < k for rank in hits) / len(item["relevant_ids"]))
+    metrics = {f"recall@{k}": float(np.mean(values)) for k, values in recalls.items()}
+    metrics["mrr"] = float(np.mean(reciprocal_ranks))
+    if latencies:
+        metrics["latency_ms_mean"] = float(np.mean(latencies))
+        metrics["latency_ms_p95"] = float(np.percentile(latencies, 95))
+    return metrics
+
+
+def sweep(items, runs, normalizations, weights_grid, recall_ks):
+    """
+    扫描全部配置组合。
+    :return: 结果列表，每项为 {"initial_topk", "normalization", "weights", "metrics"}
+    """
+    results = []
+    for topk, topk_runs in runs.items():
+        for normalization in normalizations:
+            for weights in weights_grid:
+                results.append({
+                    "initial_topk": topk,
+                    "normalization": normalization,
+                    "weights": weights,
+                    "metrics": evaluate_config(items, topk_runs, weights, normalization, recall_ks),
+                })
+    return results
+
+
+def select_best(results, objective="mrr", max_latency_ms=None):
+    """
+    选出目标指标最高的配置，指标相同时选平均延迟更低的。
+    :param max_latency_ms: 平均延迟上限，超出的配置不参与选择
+    """
+    eligible = [result for result in results
+                if max_latency_ms is None or result["metrics"].get("latency_ms_mean", 0.0) <= max_latency_ms]
+    if not eligible:
+        print(f"No configuration within {max_latency_ms} ms, ignoring the latency limit")
+        eligible = results
+    return max(eligible, key=lambda result: (round(result["metrics"][objective], 6),
+                                             -result["metrics"].get("latency_ms_mean", 0.0)))
+
+
+def format_result(result):
+    metrics = result["metrics"]
+    weights = "/".join(f"{result['weights'][name]:.2f}" for name in SCORE_NAMES)
+    recall = " ".join(f"{key}={value:.3f}" for key, value in metrics.items() if key.startswith("recall@"))
+    return (f"topk={result['initial_topk']:<3} norm={result['normalization']:<6} weights={weights}  "
+            f"{recall} mrr={metrics['mrr']:.3f} latency={metrics.get('latency_ms_mean', 0.0):.1f}ms "
+            f"(p95 {metrics.get('latency_ms_p95', 0.0):.1f}ms)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="扫描检索候选数量、归一化方法和融合权重，输出最优检索配置")
+    parser.add_argument("labelled", help="标注文件（.jsonl），每行包含 question 和 relevant_ids")
+    parser.add_argument("--collection", default="default_collection", help="DashVector 集合名称")
+    parser.add_argument("--topk", type=int, nargs="+", default=list(DEFAULT_TOPKS), help="候选数量取值")
+    parser.add_argument("--normalization", nargs="+", choices=NORMALIZATIONS, default=list(NORMALIZATIONS))
+    parser.add_argument("--weight-step", type=float, default=DEFAULT_WEIGHT_STEP, help="融合权重的扫描步长")
+    parser.add_argument("--recall-k", type=int, nargs="+", default=list(DEFAULT_RECALL_KS))
+    parser.add_argument("--objective", default="mrr", help="选择最优配置的指标，如 mrr 或 recall@1")
+    parser.add_argument("--max-latency-ms", type=float, default=None, help="平均检索延迟上限（毫秒）")
+    parser.add_argument("--task-type", default="通用问答", choices=list(GovernmentAgentPrompts.TASK_PROMPTS),
+                        help="问题未指定 task_type 时套用的任务模板，与页面检索时使用的提示一致")
+    parser.add_argument("--output", default=RETRIEVAL_CONFIG_PATH, help="最优配置的输出路径")
+    parser.add_argument("--report", default=None, help="全部配置评测结果的输出路径（.json），可选")
+    parser.add_argument("--dashscope-api-key", default=os.getenv("DASHSCOPE_API_KEY"))
+    parser.add_argument("--dashvector-api-key", default=os.getenv("DASHVECTOR_API_KEY"))
+    parser.add_argument("--dashvector-endpoint", default=os.getenv("DASHVECTOR_ENDPOINT"))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not (args.dashscope_api_key and args.dashvector_api_key and args.dashvector_endpoint):
+        raise SystemExit("Missing API keys (DASHSCOPE_API_KEY, DASHVECTOR_API_KEY, DASHVECTOR_ENDPOINT)")
+    if args.objective != "mrr" and args.objective not in (f"recall@{k}" for k in args.recall_k):
+        raise SystemExit(f"Unknown objective {args.objective!r}, use mrr or one of recall@{args.recall_k}")
+    dashscope.api_key = args.dashscope_api_key
+
+    items = load_labelled(args.labelled)
+    if not items:
+        raise SystemExit("No labelled questions")
+    engine = build_engine(args.dashvector_api_key, args.dashvector_endpoint, args.collection,
+                          config=DEFAULT_RETRIEVAL_CONFIG)
+    print(f"Collecting candidates for {len(items)} question(s), topk {sorted(set(args.topk))}")
+    runs = collect_candidates(items, engine, args.collection, sorted(set(args.topk)), args.task_type)
+    results = sweep(items, runs, args.normalization, weight_grid(args.weight_step), args.recall_k)
+
+    results.sort(key=lambda result: result["metrics"][args.objective], reverse=True)
+    print("Top configurations:")
+    for result in results[:10]:
+        print("  " + format_result(result))
+    baseline = next((result for result in results
+                     if result["initial_topk"] == DEFAULT_RETRIEVAL_CONFIG["initial_topk"]
+                     and result["normalization"] == DEFAULT_RETRIEVAL_CONFIG["normalization"]
+                     and result["weights"] == DEFAULT_RETRIEVAL_CONFIG["weights"]), None)
+    if baseline:
+        print("Current default:\n  " + format_result(baseline))
+
+    best = select_best(results, args.objective, args.max_latency_ms)
+    print("Selected:\n  " + format_result(best))
+    config = {key: best[key] for key in ("initial_topk", "normalization", "weights")}
+    config["evaluation"] = {"questions": len(items), "objective": args.objective, **best["metrics"]}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    print(f"Retrieval config written to {args.output}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
-from dashvector import Client
-from embedding_web import generate_embeddings
-
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-from rank_bm25 import BM25Okapi
-
+import os
 from transformers import AutoTokenizer, AutoModel
 import torch
 from googletrans import Translator
 from concurrent.futures import ThreadPoolExecutor
+from retrieval_core import DashVectorCandidates, RetrievalEngine, bm25_stage, cosine_similarities, tfidf_stage
+
+# 旧版新闻集合的连接参数，可通过参数或环境变量覆盖
+DEFAULT_API_KEY = os.environ.get('DASHVECTOR_API_KEY', 'sk-16zRAK4FZsfrM49D25l3dbnhT3T1d604ACD1B348E11EF853FF64DB3CBA72B')
+DEFAULT_ENDPOINT = os.environ.get('DASHVECTOR_ENDPOINT', 'vrs-cn-em93syx0600020.dashvector.cn-hangzhou.aliyuncs.com')
+DEFAULT_COLLECTION = 'news_embeddings'
+# 综合排序：结合BERT、TF-IDF和BM25的结果
+TRANSLATION_WEIGHTS = {"bert": 0.4, "tfidf": 0.3, "bm25": 0.3}
 
 # 初始化翻译器
 translator = Translator()
@@ -55,79 +56,66 @@ def translate_texts(texts, dest='en', max_workers=5):
     return translations
 
 
-def calculate_cosine_similarities(question_embedding, candidate_news_embeddings):
-    """
-    计算问题嵌入向量与候选新闻嵌入向量之间的余弦相似度。
-    :param question_embedding: 问题的嵌入向量
-    :param candidate_news_embeddings: 候选新闻的嵌入向量数组
-    :return: 相似度数组
-    """
-    return cosine_similarity([question_embedding], candidate_news_embeddings).flatten()
+class TranslationStage:
+    """把一批候选集合中的问题和候选文本一次性翻译成目标语言，供后续的 BERT、TF-IDF 和 BM25 打分使用。"""
 
-def calculate_tfidf_similarities(question_translated, candidate_news_translated):
-    """
-    计算问题和候选新闻的TF-IDF相似度。
-    :param question_translated: 翻译后的问题文本
-    :param candidate_news_translated: 翻译后的候选新闻文本列表
-    :return: 相似度数组
-    """
-    tfidf_vectorizer = TfidfVectorizer()
-    tfidf_matrix = tfidf_vectorizer.fit_transform(candidate_news_translated + [question_translated])
-    question_vector_tfidf = tfidf_matrix[-1]
-    candidate_vectors_tfidf = tfidf_matrix[:-1]
-    return cosine_similarity(question_vector_tfidf, candidate_vectors_tfidf).flatten()
+    def __init__(self, dest='en', max_workers=5):
+        self.dest = dest
+        self.max_workers = max_workers
 
-def calculate_bm25_scores(question_translated, candidate_news_translated):
-    """
-    计算BM25评分。
-    :param question_translated: 翻译后的问题文本
-    :param candidate_news_translated: 翻译后的候选新闻文本列表
-    :return: BM25评分数组
-    """
-    tokenized_candidates = [doc.split(" ") for doc in candidate_news_translated]
-    bm25 = BM25Okapi(tokenized_candidates)
-    return bm25.get_scores(question_translated.split(" "))
-
-def search_relevant_news(question):
-    """
-    根据问题搜索相关新闻。
-    :param question: 问题文本
-    :return: 最匹配的新闻文本
-    """
-    # 初始化 dashvector client
-    client = Client(
-        api_key='sk-16zRAK4FZsfrM49D25l3dbnhT3T1d604ACD1B348E11EF853FF64DB3CBA72B',
-        endpoint='vrs-cn-em93syx0600020.dashvector.cn-hangzhou.aliyuncs.com'
-    )
+    def apply(self, candidate_sets):
+        candidate_sets = [candidate_set for candidate_set in candidate_sets if candidate_set.ids]
+        texts = []
+        for candidate_set in candidate_sets:
+            texts += [candidate_set.question] + list(candidate_set.texts)
+        translations = iter(translate_texts(texts, self.dest, self.max_workers))
+        for candidate_set in candidate_sets:
+            candidate_set.query_text = next(translations)
+            candidate_set.scoring_texts = [next(translations) for _ in candidate_set.texts]
 
-    # 获取刚刚存入的集合
-    collection = client.get('news_embeddings')
-    assert collection
 
-    # 向量检索：指定 topk = 10
-    initial_topk = 3
-    rsp = collection.query(generate_embeddings(question), output_fields=['raw'], topk=initial_topk)
-    assert rsp
+class BertStage:
+    """用 BERT 嵌入的余弦相似度为候选打分，一批候选集合的全部文本合并为一次模型调用。"""
 
-    # 提取初步候选集的新闻内容
-    candidate_news = [item.fields['raw'] for item in rsp.output]
+    name = "bert"
 
-    # 将候选新闻和问题翻译成英语
-    candidate_news_translated = translate_texts(candidate_news)
-    question_translated = translate_texts([question])[0]
+    def apply(self, candidate_sets):
+        candidate_sets = [candidate_set for candidate_set in candidate_sets if candidate_set.ids]
+        if not candidate_sets:
+            return
+        texts = []
+        for candidate_set in candidate_sets:
+            texts += [candidate_set.query_text] + list(candidate_set.scoring_texts)
+        embeddings = generate_embeddings_bert(texts)
+        offset = 0
+        for candidate_set in candidate_sets:
+            count = len(candidate_set.scoring_texts)
+            candidate_set.scores[self.name] = cosine_similarities(embeddings[offset],
+                                                                  embeddings[offset + 1:offset + 1 + count])
+            offset += count + 1
 
-    # 使用BERT生成嵌入
-    candidate_news_embeddings = generate_embeddings_bert(candidate_news_translated)
-    question_embedding = generate_embeddings_bert([question_translated])[0]
 
-    # 计算相似度
-    cosine_similarities = calculate_cosine_similarities(question_embedding, candidate_news_embeddings)
-    tfidf_similarities = calculate_tfidf_similarities(question_translated, candidate_news_translated)
-    bm25_scores = calculate_bm25_scores(question_translated, candidate_news_translated)
+def build_translation_engine(api_key=DEFAULT_API_KEY, endpoint=DEFAULT_ENDPOINT, collection_name=DEFAULT_COLLECTION,
+                             initial_topk=3, weights=None):
+    """
+    构建翻译检索引擎：向量检索候选后翻译成英语，再用 BERT、TF-IDF 和 BM25 打分并加权融合。
+    旧集合的原文保存在 raw 字段中，直接随检索结果返回。
+    """
+    return RetrievalEngine(
+        DashVectorCandidates(api_key, endpoint, collection_name, text_field='raw'),
+        [TranslationStage(), BertStage(), tfidf_stage(), bm25_stage()],
+        weights=weights or TRANSLATION_WEIGHTS,
+        topk=initial_topk,
+    )
 
-    # 综合排序：结合BERT、TF-IDF和BM25的结果
-    combined_scores = 0.4 * cosine_similarities + 0.3 * tfidf_similarities + 0.3 * bm25_scores
-    best_match_index = np.argmax(combined_scores)
-    best_match_news = candidate_news[best_match_index]
 
-    return best_match_news
+def search_relevant_news(question, api_key=DEFAULT_API_KEY, endpoint=DEFAULT_ENDPOINT,
+                         collection_name=DEFAULT_COLLECTION, initial_topk=3):
+    """
+    根据问题搜索相关新闻。
+    :param question: 问题文本
+    :param initial_topk: 向量检索返回的候选数量
+    :return: 最匹配的新闻文本，没有候选时返回 None
+    """
+    ranked = build_translation_engine(api_key, endpoint, collection_name, initial_topk).search(question)
+    return ranked[0]["text"] if ranked else None
@@ -1,68 +1,102 @@
-from dashvector import Client
-from embedding_web import generate_embeddings
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-from rank_bm25 import BM25Okapi
+import os
+import re
+import json
+from chunk_store import get_chunk_store
+from text_structure import CHINESE_NUMERALS
+from retrieval_core import NORMALIZATIONS, DashVectorCandidates, RetrievalEngine, bm25_stage, tfidf_stage
 
-def calculate_tfidf_similarities(question, candidate_news):
+# 检索配置文件，由 retrieval_eval.py 评测后生成；不存在时使用默认配置
+RETRIEVAL_CONFIG_PATH = os.environ.get("RETRIEVAL_CONFIG_PATH", "retrieval_config.json")
+DEFAULT_RETRIEVAL_CONFIG = {
+    "initial_topk": 3,
+    "normalization": "none",
+    "weights": {"vector": 0.9, "tfidf": 0.05, "bm25": 0.05},
+}
+
+def infer_filters(question, collection_name):
     """
-    计算问题和候选新闻的TF-IDF相似度。
+    从问题中推断过滤条件：提到的文件名、年份（如“2023年”）和章（如“第三章”）。
     :param question: 问题文本
-    :param candidate_news: 候选新闻文本列表
-    :return: 相似度数组
+    :param collection_name: 集合名称，用于读取已入库的文件名
+    :return: 过滤条件字典，可能为空
     """
-    tfidf_vectorizer = TfidfVectorizer()
-    tfidf_matrix = tfidf_vectorizer.fit_transform(candidate_news + [question])
-    question_vector_tfidf = tfidf_matrix[-1]
-    candidate_vectors_tfidf = tfidf_matrix[:-1]
-    return cosine_similarity(question_vector_tfidf, candidate_vectors_tfidf).flatten()
+    filters = {}
+    sources = [
+        source for source in get_chunk_store().list_sources(collection_name)
+        if len(os.path.splitext(source)[0]) >= 2 and os.path.splitext(source)[0].lower() in question.lower()
+    ]
+    if sources:
+        filters["source"] = sources
+    years = re.findall(r'((?:19|20)\d{2})年', question)
+    if years:
+        filters["year"] = sorted({int(year) for year in years})
+    chapter = re.search(rf'第[{CHINESE_NUMERALS}]+章', question)
+    if chapter:
+        filters["chapter"] = chapter.group()
+    return filters
 
-def calculate_bm25_scores(question, candidate_news):
+def load_retrieval_config(path=RETRIEVAL_CONFIG_PATH):
     """
-    计算BM25评分。
-    :param question: 问题文本
-    :param candidate_news: 候选新闻文本列表
-    :return: BM25评分数组
+    读取检索配置（由 retrieval_eval.py 评测生成），缺少的字段使用默认值。
+    :param path: 配置文件路径，文件不存在时返回默认配置
+    :return: {"initial_topk", "normalization", "weights"} 字典
     """
-    tokenized_candidates = [doc.split(" ") for doc in candidate_news]
-    bm25 = BM25Okapi(tokenized_candidates)
-    return bm25.get_scores(question.split(" "))
+    config = {**DEFAULT_RETRIEVAL_CONFIG, "weights": dict(DEFAULT_RETRIEVAL_CONFIG["weights"])}
+    if not path or not os.path.exists(path):
+        return config
+    try:
+        with open(path, encoding="utf-8") as f:
+            loaded = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error loading retrieval config {path}: {e}")
+        return config
+    for key in ("initial_topk", "normalization"):
+        if key in loaded:
+            config[key] = loaded[key]
+    config["weights"].update(loaded.get("weights", {}))
+    if config["normalization"] not in NORMALIZATIONS:
+        print(f"Unknown normalization {config['normalization']!r} in {path}, using 'none'")
+        config["normalization"] = "none"
+    return config
 
-def search_relevant_news(question, api_key, endpoint_key,collection_name):
+def build_engine(api_key, endpoint_key, collection_name, config=None, embedding_cache=None):
     """
-    根据问题搜索相关新闻。
-    :param question: 问题文本
-    :return: 最匹配的新闻文本
+    按检索配置构建检索引擎：向量检索候选，TF-IDF 和 BM25 打分，加权融合。
+    :param config: 检索配置，默认由 load_retrieval_config 读取
+    :param embedding_cache: 问题向量缓存，可选
     """
-    # 初始化 dashvector client
-    client = Client(
-        api_key=api_key,
-        endpoint=endpoint_key
+    config = config or load_retrieval_config()
+    return RetrievalEngine(
+        DashVectorCandidates(api_key, endpoint_key, collection_name, embedding_cache=embedding_cache),
+        [tfidf_stage(), bm25_stage()],
+        weights=config["weights"],
+        normalization=config["normalization"],
+        topk=config["initial_topk"],
     )
 
-    # 获取刚刚存入的集合
-    collection = client.get(collection_name)
-    assert collection
-
-    # 向量检索：指定 topk = 3
-    initial_topk = 3
-    rsp = collection.query(generate_embeddings(question), output_fields=['raw'], topk=initial_topk)
-    assert rsp
-
-    # 提取初步候选集的新闻内容
-    candidate_news = [item.fields['raw'] for item in rsp.output]
-    # 向量相似度
-    vector_search_similarities = [item.score for item in rsp.output]  # 直接使用库返回的相似度分数
-
-    # 使用TF-IDF和BM25计算文本相似度
-    tfidf_similarities = calculate_tfidf_similarities(question, candidate_news)
-    bm25_scores = calculate_bm25_scores(question, candidate_news)
-
-    # 综合排序：结合向量检索、TF-IDF和BM25的结果
-    combined_scores = 0.9 * np.array(vector_search_similarities) + 0.05 * np.array(tfidf_similarities) + 0.05 * np.array(bm25_scores)
-    best_match_index = np.argmax(combined_scores)
-    best_match_news = candidate_news[best_match_index]
-
-    return best_match_news
+def search_many_news(questions, api_key, endpoint_key, collection_name, filters=None, query_vectors=None,
+                     config=None, embedding_cache=None):
+    """
+    批量检索多个问题，问题向量合并生成，向量库查询并发执行。
+    :param filters: 与 questions 对齐的过滤条件列表，可选
+    :param query_vectors: 与 questions 对齐的预先计算好的问题向量，可选
+    :return: 与 questions 对齐的最匹配文本列表，没有候选的问题为 None
+    """
+    engine = build_engine(api_key, endpoint_key, collection_name, config, embedding_cache)
+    results = engine.search_many(questions, top_n=1, filters=filters, query_vectors=query_vectors)
+    return [ranked[0]["text"] if ranked else None for ranked in results]
 
+def search_relevant_news(question, api_key, endpoint_key, collection_name, initial_topk=None, filters=None,
+                         query_vector=None, config=None):
+    """
+    根据问题搜索相关新闻。
+    :param question: 问题文本
+    :param initial_topk: 向量检索返回的候选数量，默认取检索配置
+    :param filters: 元数据过滤条件（见 retrieval_core.build_filter_expression），在向量库中执行；过滤后没有结果时退回全库检索
+    :param query_vector: 预先计算好的问题向量，可选；为空时调用嵌入接口生成
+    :param config: 检索配置（候选数量、归一化方法、融合权重），默认由 load_retrieval_config 读取
+    :return: 最匹配的新闻文本，没有候选时返回 None
+    """
+    engine = build_engine(api_key, endpoint_key, collection_name, config)
+    ranked = engine.search(question, top_n=1, topk=initial_topk, filters=filters, query_vector=query_vector)
+    return ranked[0]["text"] if ranked else None
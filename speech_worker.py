@@ -0,0 +1,138 @@
+import re
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pyttsx3
+import speech_recognition as sr
+
+SPEECH_RATE = 150
+SPEECH_VOICE = 'zh'
+# 句子结束符：遇到这些字符即可开始朗读该句
+SENTENCE_END = re.compile(r'[^。！？!?；;\n]*[。！？!?；;\n]+')
+
+
+class SentenceSplitter:
+    """把逐步到达的文本切成完整的句子，未结束的半句留到下次。"""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text):
+        """
+        追加文本。
+        :return: 新出现的完整句子列表
+        """
+        self._buffer += text
+        sentences = []
+        end = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            sentences.append(match.group())
+            end = match.end()
+        self._buffer = self._buffer[end:]
+        return [sentence for sentence in sentences if sentence.strip()]
+
+    def flush(self):
+        """返回并清空剩余的半句。"""
+        rest, self._buffer = self._buffer, ""
+        return rest if rest.strip() else None
+
+
+class SpeechStream:
+    """一次回答对应的朗读流：边接收文本边按句送入朗读队列。"""
+
+    def __init__(self, worker, generation):
+        self._worker = worker
+        self._generation = generation
+        self._splitter = SentenceSplitter()
+
+    def feed(self, text):
+        for sentence in self._splitter.feed(text):
+            self._worker.enqueue(self._generation, sentence)
+
+    def close(self):
+        rest = self._splitter.flush()
+        if rest:
+            self._worker.enqueue(self._generation, rest)
+
+
+class SpeechWorker:
+    """
+    常驻朗读线程：只初始化一次 pyttsx3 引擎，按句从队列中取出朗读。
+    新回答开始时取消上一条回答尚未读完的句子。
+    """
+
+    def __init__(self, rate=SPEECH_RATE, voice=SPEECH_VOICE):
+        self.rate = rate
+        self.voice = voice
+        self._queue = queue.Queue()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._engine = None
+        self._thread = threading.Thread(target=self._run, name="speech-worker", daemon=True)
+        self._thread.start()
+
+    def new_stream(self):
+        """取消正在朗读的内容，开始一条新的朗读流。"""
+        self.cancel()
+        with self._lock:
+            return SpeechStream(self, self._generation)
+
+    def speak(self, text):
+        """朗读一段完整文本。"""
+        stream = self.new_stream()
+        stream.feed(text)
+        stream.close()
+
+    def cancel(self):
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        if self._engine is not None:
+            self._engine.stop()
+
+    def enqueue(self, generation, sentence):
+        self._queue.put((generation, sentence))
+
+    def _run(self):
+        self._engine = pyttsx3.init()
+        self._engine.setProperty('rate', self.rate)
+        self._engine.setProperty('voice', self.voice)
+        while True:
+            generation, sentence = self._queue.get()
+            with self._lock:
+                if generation != self._generation:
+                    continue
+            try:
+                self._engine.say(sentence)
+                self._engine.runAndWait()
+            except Exception as e:
+                print(f"Error in text to speech: {e}")
+
+
+# 麦克风同一时间只能被一个识别任务占用
+_recognizer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speech-recognizer")
+
+
+def recognize_speech():
+    """
+    录音并识别为中文文本，在后台线程中执行。
+    :return: (识别结果, 错误信息)，两者只有一个不为 None
+    """
+    recognizer = sr.Recognizer()
+    with sr.Microphone() as source:
+        audio = recognizer.listen(source)
+    try:
+        return recognizer.recognize_google(audio, language="zh-CN"), None
+    except sr.UnknownValueError:
+        return None, "无法识别语音"
+    except sr.RequestError:
+        return None, "无法连接到语音识别服务"
+
+
+def start_speech_to_text():
+    """在后台开始语音识别，立即返回 Future，结果为 recognize_speech 的返回值。"""
+    return _recognizer_executor.submit(recognize_speech)
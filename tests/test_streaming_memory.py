@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("jieba")
+pytest.importorskip("resource")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGE_COUNT = 6000
+# 每页约 1300 个字符，整个流约 800 万字符，标题数超过结构表上限；全部读入内存时仅原文就约占 16 MiB，远超下面的上限
+PAGE_REPEAT = 30
+RSS_GROWTH_BOUND_KB = 8 * 1024
+
+# 在子进程中运行，峰值 RSS 只反映本次分析，也包含分词、PDF 解析等原生代码的内存
+ANALYZE_SCRIPT = f"""
+import resource
+import jieba
+from text_analysis import StreamingTextAnalyzer
+
+
+def chinese_numeral(number):
+    digits = "零一二三四五六七八九"
+    text = ""
+    for unit, name in ((1000, "千"), (100, "百"), (10, "十"), (1, "")):
+        digit, number = divmod(number, unit)
+        if digit:
+            text += digits[digit] + name
+        elif text and number and not text.endswith("零"):
+            text += "零"
+    return text
+
+
+def peak_rss_kb():
+    # ru_maxrss 会带上 fork 时父进程的峰值，Linux 上改读本进程映像自己的峰值 VmHWM
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+generated_chars = 0
+
+
+def generate_pages(page_count):
+    global generated_chars
+    for page in range(1, page_count + 1):
+        lines = []
+        if page % 50 == 1:
+            lines.append(f"第{{chinese_numeral(page // 50 + 1)}}章 总则")
+        lines.append(f"第{{chinese_numeral(page)}}条 本办法适用于第{{page}}页所述事项，违反本办法的，由有关部门责令改正。")
+        lines.append("为了规范政务服务行为，提高行政效率，保障公民、法人和其他组织的合法权益，制定本办法。" * {PAGE_REPEAT})
+        text = "\\n".join(lines) + "\\n"
+        generated_chars += len(text)
+        yield page, text
+
+
+# 先加载分词词典，避免把一次性的词典内存计入增长
+jieba.lcut("预热分词词典")
+before = peak_rss_kb()
+analyzer = StreamingTextAnalyzer().run(generate_pages({PAGE_COUNT}))
+after = peak_rss_kb()
+assert analyzer.total_chars == generated_chars, (analyzer.total_chars, generated_chars)
+assert len(analyzer.preview_chunks) == analyzer.max_preview_chunks
+assert len(analyzer.structure) == analyzer.max_structure_entries
+assert analyzer.skipped_headings > 0
+print(after - before, generated_chars)
+"""
+
+
+def test_streaming_analyzer_peak_rss_is_bounded():
+    result = subprocess.run([sys.executable, "-c", ANALYZE_SCRIPT], cwd=REPO_ROOT,
+                            capture_output=True, text=True, timeout=600)
+    assert result.returncode == 0, result.stderr
+    rss_growth_kb, total_chars = map(int, result.stdout.split()[-2:])
+    assert rss_growth_kb < RSS_GROWTH_BOUND_KB, f"peak RSS grew {rss_growth_kb} KiB for {total_chars} chars"
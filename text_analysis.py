@@ -0,0 +1,79 @@
+"""
+大文档的逐页流式分析，只依赖分词和文档结构解析，不依赖页面组件，可单独导入和测试。
+"""
+from collections import Counter
+import jieba
+from text_structure import heading_level, iter_structured_chunks
+
+STREAMING_MAX_VOCABULARY = 50000
+STREAMING_MAX_LINE_LENGTH = 4096
+STREAMING_MAX_STRUCTURE_ENTRIES = 5000
+
+
+class StreamingTextAnalyzer:
+    """
+    逐页分析大文档：词频、分块统计和章/节/条结构都增量计算，内存占用与文档总长度无关。
+    :param chunk_size: 分块大小
+    :param preview_length: 保留的原文预览长度
+    :param max_preview_chunks: 保留原文的文本块数量，其余只记录长度
+    :param max_vocabulary: 词频表的最大词条数，超出时只保留高频词
+    :param max_structure_entries: 保留的章/节/条标题数量，其余只计数
+    """
+
+    def __init__(self, chunk_size=1000, preview_length=1000, max_preview_chunks=50,
+                 max_vocabulary=STREAMING_MAX_VOCABULARY, max_structure_entries=STREAMING_MAX_STRUCTURE_ENTRIES):
+        self.chunk_size = chunk_size
+        self.preview_length = preview_length
+        self.max_preview_chunks = max_preview_chunks
+        self.max_vocabulary = max_vocabulary
+        self.max_structure_entries = max_structure_entries
+        self.preview = ""
+        self.word_counts = Counter()
+        self.chunk_lengths = []
+        self.preview_chunks = []
+        self.structure = []
+        self.skipped_headings = 0
+        self.total_chars = 0
+
+    def _observe(self, segments):
+        carry = ""
+        for page, text in segments:
+            self.total_chars += len(text)
+            if len(self.preview) < self.preview_length:
+                self.preview += text[:self.preview_length - len(self.preview)]
+
+            self.word_counts.update(jieba.lcut(text))
+            if len(self.word_counts) > 2 * self.max_vocabulary:
+                self.word_counts = Counter(dict(self.word_counts.most_common(self.max_vocabulary)))
+
+            # 跨页的半行拼接到下一页；只有行首决定是否为标题，超长行只保留开头
+            lines = (carry + text).split('\n')
+            carry = lines.pop()[:STREAMING_MAX_LINE_LENGTH]
+            self._collect_headings(lines)
+            yield page, text
+        self._collect_headings([carry])
+
+    def _collect_headings(self, lines):
+        for line in lines:
+            level = heading_level(line)
+            if level is None:
+                continue
+            if len(self.structure) < self.max_structure_entries:
+                self.structure.append({"level": level, "content": line.strip()[:200]})
+            else:
+                self.skipped_headings += 1
+
+    def run(self, segments):
+        """
+        消费 (页码, 文本) 流并完成全部统计。
+        :return: self
+        """
+        for chunk in iter_structured_chunks(self._observe(segments), self.chunk_size):
+            self.chunk_lengths.append(len(chunk["text"]))
+            if len(self.preview_chunks) < self.max_preview_chunks:
+                self.preview_chunks.append(chunk["text"])
+        return self
+
+    def top_words(self, n=20):
+        """:return: 出现次数最多的 n 个 (词, 次数)"""
+        return self.word_counts.most_common(n)
@@ -0,0 +1,160 @@
+import re
+
+CHINESE_NUMERALS = "零〇一二两三四五六七八九十百千"
+_NUMERAL_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4,
+                   "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_NUMERAL_UNITS = {"十": 10, "百": 100, "千": 1000}
+
+# 中文法律文档的常见结构标记
+STRUCTURE_MARKER = re.compile(rf'第[{CHINESE_NUMERALS}]+[章节条]|\d+\.')
+STRUCTURE_LEVELS = [
+    (re.compile(rf'第[{CHINESE_NUMERALS}]+章'), 1),
+    (re.compile(rf'第[{CHINESE_NUMERALS}]+节'), 2),
+    (re.compile(rf'第[{CHINESE_NUMERALS}]+条'), 3),
+]
+# 结构标记前面是这些字符（或位于文档开头）时才视为标题，避免把正文中的“依照第二十条”当作新的一条
+HEADING_BOUNDARY = " \t\n\u3000。；;：:"
+# 标题中的结构标记后面紧跟空白（或位于文本末尾），正文中的引用如“第二十条规定的”不满足这一点
+HEADING_TERMINATORS = " \t\r\n\u3000"
+# 结构路径的字段名，依次对应章、节、条
+STRUCTURE_PATH_FIELDS = ("chapter", "section", "article")
+# 强制切分过长段落时在缓冲区末尾保留的字符数，避免把跨页的结构标记切断
+_MARKER_MARGIN = 16
+
+
+def parse_numeral(text):
+    """
+    把中文数字或阿拉伯数字转换为整数，例如 "二十三" -> 23，"一百零五" -> 105，"23" -> 23。
+    :return: 整数，无法解析时返回 None
+    """
+    if text.isdigit():
+        return int(text)
+    total, digit = 0, 0
+    for char in text:
+        if char in _NUMERAL_DIGITS:
+            digit = _NUMERAL_DIGITS[char]
+        elif char in _NUMERAL_UNITS:
+            total += (digit or 1) * _NUMERAL_UNITS[char]
+            digit = 0
+        else:
+            return None
+    return total + digit
+
+
+def marker_number(marker):
+    """返回结构标记（如 "第二十三条"）中的序号，marker 为空时返回 None。"""
+    return parse_numeral(marker[1:-1]) if marker else None
+
+
+def heading_level(line):
+    """返回行首结构标记的层级（章=1，节=2，条=3），不是标题行时返回 None。标记后面须紧跟空白或位于行尾。"""
+    for pattern, level in STRUCTURE_LEVELS:
+        match = pattern.match(line)
+        if match:
+            return level if line[match.end():match.end() + 1] in ("", *HEADING_TERMINATORS) else None
+    return None
+
+
+def iter_structure(lines):
+    """
+    逐行提取文档结构。
+    :param lines: 行的可迭代对象
+    :return: {"level", "content"} 生成器，非标题行沿用上一行的层级
+    """
+    current_level = 0
+    for line in lines:
+        if line.strip():
+            level = heading_level(line)
+            if level is None:
+                level = current_level
+            yield {"level": level, "content": line.strip()}
+            current_level = level
+
+
+def _page_at(pages, position):
+    page = pages[0][1]
+    for offset, candidate in pages:
+        if offset > position:
+            break
+        page = candidate
+    return page
+
+
+def iter_sections(segments, max_section_length=1000):
+    """
+    流式切分结构段落：每段以结构标记开头（首段除外），超长段落按 max_section_length 强制切分，
+    缓冲区大小因此有上限。
+    :param segments: (页码, 文本) 的可迭代对象
+    :param max_section_length: 单段最大长度
+    :return: (起始页码, 段落文本) 生成器
+    """
+    buffer = ""
+    pages = []
+    for page, text in segments:
+        pages.append((len(buffer), page))
+        buffer += text
+
+        cuts = [match.start() for match in STRUCTURE_MARKER.finditer(buffer) if match.start() > 0]
+        start = 0
+        for cut in cuts:
+            yield _page_at(pages, start), buffer[start:cut]
+            start = cut
+        while len(buffer) - start > max_section_length + _MARKER_MARGIN:
+            yield _page_at(pages, start), buffer[start:start + max_section_length]
+            start += max_section_length
+
+        if start:
+            current_page = _page_at(pages, start)
+            pages = [(0, current_page)] + [(offset - start, p) for offset, p in pages if offset > start]
+            buffer = buffer[start:]
+    if buffer:
+        yield _page_at(pages, 0), buffer
+
+
+def update_structure_path(path, section, previous_section=""):
+    """
+    根据段落开头的结构标记更新章/节/条路径，进入新的章时清空节和条，进入新的节时清空条。
+    :param path: {"chapter", "section", "article"} 当前路径，原地更新
+    :param section: 段落文本
+    :param previous_section: 上一个段落，用于判断标记是否位于标题位置
+    :return: 段落开头是标题时返回其层级，否则返回 None
+    """
+    if previous_section and previous_section[-1] not in HEADING_BOUNDARY:
+        return None
+    level = heading_level(section)
+    if level is None:
+        return None
+    marker = STRUCTURE_LEVELS[level - 1][0].match(section).group()
+    path[STRUCTURE_PATH_FIELDS[level - 1]] = marker
+    for field in STRUCTURE_PATH_FIELDS[level:]:
+        path[field] = None
+    return level
+
+
+def iter_structured_chunks(segments, chunk_size=1000):
+    """
+    按文档结构流式分块：相邻段落合并到不超过 chunk_size 的文本块中。
+    :param segments: (页码, 文本) 的可迭代对象
+    :param chunk_size: 文本块最大长度
+    :return: {"text", "page", "path", "articles"} 生成器，page 为文本块起始页码，path 为文本块开头所在的章/节/条，
+             articles 为文本块中包含（或延续）的各条的路径
+    """
+    path = dict.fromkeys(STRUCTURE_PATH_FIELDS)
+    current, current_page, current_path, current_articles = "", None, dict(path), []
+    previous = ""
+    for page, section in iter_sections(segments, chunk_size):
+        level = update_structure_path(path, section, previous)
+        previous = section
+        if current and len(current) + len(section) > chunk_size:
+            yield {"text": current, "page": current_page, "path": current_path, "articles": current_articles}
+            current, current_page, current_path, current_articles = "", None, dict(path), []
+        if not current:
+            current_page, current_path = page, dict(path)
+            # 文本块以某条的后半部分开头时，也记为包含该条
+            if level != 3 and path["article"]:
+                current_articles.append(dict(path))
+        if level == 3:
+            current_articles.append(dict(path))
+        current += section
+    if current:
+        yield {"text": current, "page": current_page, "path": current_path, "articles": current_articles}